@@ -0,0 +1,205 @@
+'''
+Load test of every endpoint, with results saved for comparison.
+
+For each size of synthetic question bank spread over --categories
+categories, serves the API (threaded Flask server or uvicorn) and drives
+one route at a time with --concurrency clients for --duration seconds:
+GET /categories, GET /questions?page=, GET /categories/<id>/questions,
+search (POST /questions with a searchTerm), POST /quizzes, POST /questions
+and DELETE /questions/<id>. Reports requests/sec and p50/p95/p99 latency
+per route, writes them to a JSON file and, given the file of an earlier
+run, prints the change. Run from the backend directory:
+
+    python -m benchmarks.endpoints --output before.json
+    python -m benchmarks.endpoints --output after.json --compare before.json
+    python -m benchmarks.endpoints --sizes 1000 100000 1000000 \
+        --database-url postgresql://localhost/trivia_bench
+'''
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.quiz_selection import CATEGORIES, seed
+from benchmarks.serving_modes import MODES, load, percentile, wait_until_up
+
+# the writes come last, the reads see the bank as seeded
+ROUTES = ('categories', 'questions', 'category_questions', 'search',
+          'quizzes', 'create', 'delete')
+
+
+def category_names(count):
+    return [CATEGORIES[i] if i < len(CATEGORIES) else
+            'Category {}'.format(i + 1) for i in range(count)]
+
+
+def route_mix(route, size, categories, deletable):
+    '''function returning an endless iterator of the (method, path, body)
+    requests of route, for one client'''
+    pages = max(1, size // 10)
+
+    def mix():
+        while True:
+            category = random.randint(1, categories)
+            if route == 'categories':
+                yield 'GET', '/categories', None
+            elif route == 'questions':
+                yield 'GET', '/questions?page={}'.format(
+                    random.randint(1, pages)), None
+            elif route == 'category_questions':
+                yield 'GET', '/categories/{}/questions?page={}'.format(
+                    category, random.randint(
+                        1, max(1, pages // categories))), None
+            elif route == 'search':
+                yield 'POST', '/questions', json.dumps({
+                    'searchTerm': 'question {}'.format(
+                        random.randint(1, size))
+                })
+            elif route == 'quizzes':
+                yield 'POST', '/quizzes', json.dumps({
+                    'quiz_category': {'id': category},
+                    'previous_questions': random.sample(
+                        range(1, size + 1), min(size, 5))
+                })
+            elif route == 'create':
+                yield 'POST', '/questions', json.dumps({
+                    'question': 'Benchmark question {}'.format(
+                        random.getrandbits(64)),
+                    'answer': 'Benchmark answer',
+                    'category': category,
+                    'difficulty': random.randint(1, 5)
+                })
+            else:
+                # each seeded question is deleted once, by one client,
+                # the clients stop when none are left
+                question_id = next(deletable, None)
+                if question_id is None:
+                    return
+                yield 'DELETE', '/questions/{}'.format(question_id), None
+    return mix
+
+
+def summarize(size, route, completed, errors, timings, duration):
+    return {
+        'size': size,
+        'route': route,
+        'requests': completed,
+        'errors': errors,
+        'throughput': round(completed / duration, 1),
+        'p50_ms': round(percentile(timings, 0.5), 3) if timings else None,
+        'p95_ms': round(percentile(timings, 0.95), 3) if timings else None,
+        'p99_ms': round(percentile(timings, 0.99), 3) if timings else None
+    }
+
+
+def report(result):
+    print('{size:>9} {route:<19} {throughput:>9.1f} req/s   '
+          'p50 {p50_ms:>8} ms   p95 {p95_ms:>8} ms   p99 {p99_ms:>8} ms   '
+          '{errors} errors'.format(**result))
+
+
+def compare(results, baseline):
+    '''prints the change of throughput and p99 latency of each route
+    against the results of an earlier run'''
+    earlier = {(result['size'], result['route']): result
+               for result in baseline['results']}
+    print('\nchange against {} ({})'.format(
+        baseline.get('commit') or 'baseline', baseline.get('created')))
+    for result in results:
+        before = earlier.get((result['size'], result['route']))
+        if before is None or not before['throughput'] or \
+                not before['p99_ms'] or not result['p99_ms']:
+            continue
+        print('{:>9} {:<19} throughput {:>+7.1f}%   p99 {:>+7.1f}%'.format(
+            result['size'], result['route'],
+            (result['throughput'] / before['throughput'] - 1) * 100,
+            (result['p99_ms'] / before['p99_ms'] - 1) * 100))
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000],
+                        help='questions in the synthetic banks')
+    parser.add_argument('--categories', type=int, default=len(CATEGORIES))
+    parser.add_argument('--routes', nargs='+', choices=ROUTES,
+                        default=ROUTES)
+    parser.add_argument('--mode', choices=MODES, default='wsgi')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds of load per route')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of an earlier run')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'endpoints_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # the server reads the database from the environment, as in production
+    os.environ['DATABASE_URL'] = database_url
+    from flaskr import create_app
+    app = create_app()
+
+    results = []
+    for size in args.sizes:
+        with app.app_context():
+            seed(size, categories=category_names(args.categories))
+
+        # a fresh server per bank, so no cache outlives its data
+        server = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.serving_modes',
+            '--serve', args.mode, '--port', str(args.port)])
+        try:
+            wait_until_up(args.port)
+            deletable = iter(range(size, 0, -1))
+            for route in ROUTES:
+                if route not in args.routes:
+                    continue
+                completed, errors, timings = load(
+                    args.port, args.concurrency, args.duration,
+                    route_mix(route, size, args.categories, deletable))
+                result = summarize(size, route, completed, errors, timings,
+                                   args.duration)
+                report(result)
+                results.append(result)
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'commit': current_commit(),
+                'created': datetime.datetime.utcnow().isoformat() + 'Z',
+                'mode': args.mode,
+                'database': database_url.split(':', 1)[0],
+                'categories': args.categories,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'results': results
+            }, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Benchmark of the compact question store and the question snapshot.
+
+Loads synthetic question banks into the column store and reports its
+memory per 100k questions, against the same questions held as a list of
+QuestionRecord tuples (measured with tracemalloc). Builds a snapshot file
+of the same questions and reports its size and build time. Reports the
+latency of a random page read from the store, the mapped snapshot and the
+database. Run from the backend directory:
+
+    python -m benchmarks.question_store
+    python -m benchmarks.question_store --sizes 100000 1000000 \
+        --database-url postgresql://localhost/trivia_bench
+'''
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.quiz_selection import seed
+from flaskr import create_app
+from flaskr.snapshot import Snapshot, build_snapshot
+from flaskr.store import QuestionStore
+from models import db, read_questions, Question
+
+
+def records_bytes():
+    '''bytes allocated to hold every question as QuestionRecords'''
+    tracemalloc.start()
+    records = read_questions().order_by(Question.id).all()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return allocated
+
+
+def page_timings(read_page, pages, repeat):
+    timings = []
+    for _ in range(repeat):
+        page = random.randint(1, pages)
+        start = time.perf_counter()
+        read_page(page)
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+    return statistics.median(timings)
+
+
+def database_page(page):
+    return read_questions().order_by(Question.id)\
+        .offset((page - 1) * 10).limit(10).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'question_store_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # engine options follow the database url, so set it before the app
+    os.environ['DATABASE_URL'] = database_url
+    app = create_app()
+
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            pages = max(1, size // 10)
+
+            store = QuestionStore()
+            store.enabled = True
+            start = time.perf_counter()
+            store.load()
+            load_ms = (time.perf_counter() - start) * 1000
+            stats = store.stats()
+            print('{:>9} store     load {:>9.1f} ms   {:>12,} bytes per '
+                  '100k questions'.format(size, load_ms,
+                                          stats['bytes_per_100k_questions']))
+            print('{:>9} records                      {:>12,} bytes per '
+                  '100k questions'.format(
+                      size, records_bytes() * 100000 // size))
+
+            path = os.path.join(tempfile.mkdtemp(), 'questions.snap')
+            start = time.perf_counter()
+            build_snapshot(path)
+            build_ms = (time.perf_counter() - start) * 1000
+            snapshot = Snapshot(path)
+            print('{:>9} snapshot  build {:>8.1f} ms   {:>12,} bytes per '
+                  '100k questions'.format(
+                      size, build_ms,
+                      os.path.getsize(path) * 100000 // size))
+
+            print('{:>9} page      store {:>8.3f} ms   snapshot {:>8.3f} ms'
+                  '   database {:>8.3f} ms'.format(size, page_timings(
+                      lambda page: store.page(None, page), pages,
+                      args.repeat), page_timings(
+                      lambda page: snapshot.page(None, page), pages,
+                      args.repeat), page_timings(
+                      database_page, pages, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
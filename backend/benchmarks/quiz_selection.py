@@ -0,0 +1,114 @@
+'''
+Benchmark of the POST /quizzes question selection.
+
+Compares the original path (load every question NOT IN previous_questions,
+shuffle, keep one) with the in-memory QuizIndex for synthetic question
+banks of increasing size. Run from the backend directory:
+
+    python -m benchmarks.quiz_selection
+    python -m benchmarks.quiz_selection --sizes 1000 100000 \
+        --database-url postgresql://localhost/trivia_bench
+'''
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.quiz import QuizIndex
+from models import db, Question, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History',
+              'Entertainment', 'Sports']
+
+
+def seed(size, batch=10000, categories=CATEGORIES):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Category.__table__.insert(),
+                       [{'type': name} for name in categories])
+    for start in range(0, size, batch):
+        db.session.execute(Question.__table__.insert(), [{
+            'question': 'Synthetic question {}'.format(i),
+            'answer': 'Answer {}'.format(i),
+            'category': i % len(categories) + 1,
+            'difficulty': i % 5 + 1
+        } for i in range(start, min(start + batch, size))])
+    db.session.commit()
+
+
+def legacy_next(category, previous_questions):
+    query = Question.query.filter(~Question.id.in_(previous_questions))
+    if category:
+        query = query.filter(Question.category == category)
+    questions = query.all()
+    if not questions:
+        return None
+    random.shuffle(questions)
+    return questions[0].format()
+
+
+def indexed_next(index, category, previous_questions):
+    question = index.next_question(category or None, previous_questions)
+    return question.format() if question is not None else None
+
+
+def play(select, steps):
+    '''times each step of a quiz over all categories, in milliseconds'''
+    timings = []
+    previous_questions = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        question = select(0, previous_questions)
+        timings.append((time.perf_counter() - start) * 1000)
+        previous_questions.append(question['id'])
+        db.session.remove()
+    return timings
+
+
+def report(size, name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print('{:>9} {:<8} mean {:>9.3f} ms   p95 {:>9.3f} ms'.format(
+        size, name, statistics.mean(timings), p95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000])
+    parser.add_argument('--steps', type=int, default=10,
+                        help='quiz steps timed per size')
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'quiz_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # engine options follow the database url, so set it before the app
+    os.environ['DATABASE_URL'] = database_url
+    app = create_app()
+
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+
+            report(size, 'legacy', play(legacy_next, args.steps))
+
+            index = QuizIndex()
+            start = time.perf_counter()
+            index.choose()
+            print('{:>9} {:<8} index build {:.1f} ms'.format(
+                size, 'indexed', (time.perf_counter() - start) * 1000))
+            report(size, 'indexed', play(
+                lambda category, previous: indexed_next(
+                    index, category, previous), args.steps))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''
+Benchmark of Question instances against read_questions() records.
+
+Times loading and formatting a page of questions as ORM instances
+(Question.query) and as column-projected QuestionRecord tuples
+(read_questions()), and measures the memory allocated per page with
+tracemalloc, for pages of 10 and 1000 rows. Run from the backend
+directory:
+
+    python -m benchmarks.read_queries
+    python -m benchmarks.read_queries --pages 10 1000 10000 \
+        --database-url postgresql://localhost/trivia_bench
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.quiz_selection import seed
+from flaskr import create_app
+from models import db, read_questions, Question
+
+QUERIES = (
+    ('orm', lambda: Question.query),
+    ('records', read_questions),
+)
+
+
+def page(query, size):
+    return [question.format() for question in
+            query().order_by(Question.id).limit(size).all()]
+
+
+def measure(query, size, repeat):
+    '''(median milliseconds, median peak KiB allocated) of a page of
+    size rows'''
+    timings, peaks = [], []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        page(query, size)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        db.session.remove()
+        tracemalloc.start()
+        page(query, size)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return statistics.median(timings), statistics.median(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'read_queries_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # engine options follow the database url, so set it before the app
+    os.environ['DATABASE_URL'] = database_url
+    app = create_app()
+
+    with app.app_context():
+        seed(max(args.pages))
+        for size in args.pages:
+            for name, query in QUERIES:
+                milliseconds, peak = measure(query, size, args.repeat)
+                print('{:>7} {:<8} {:>9.3f} ms   peak {:>9.1f} KiB '
+                      'allocated'.format(size, name, milliseconds, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Microbenchmark of the serialization of question pages.
+
+Compares the original path (load Question objects, format() them into
+dicts, jsonify) with the row tuple path (load the question columns,
+encode each question straight from its row, reuse the cached bytes of
+questions already encoded), for pages of increasing size. Run from the
+backend directory:
+
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --pages 10 1000 10000 --repeat 50
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from flask import jsonify
+
+from benchmarks.quiz_selection import seed
+from flaskr import create_app
+from flaskr.questioncache import QuestionCache
+from flaskr.serialize import JSONProvider, orjson
+from models import db, read_questions, Question
+
+
+def legacy_page(size):
+    questions = Question.query.order_by(Question.id).limit(size).all()
+    payload = {
+        "success": True,
+        "questions": [question.format() for question in questions],
+        "total_questions": size
+    }
+    # jsonify pretty-prints when the app runs in debug mode
+    return jsonify(payload).get_data()
+
+
+def rows_page(size, cache, provider):
+    generation = cache.generation
+    rows = read_questions().order_by(Question.id).limit(size).all()
+    questions = cache.encode_rows(rows, generation)
+    return b'{"questions":' + questions + b',"success":true,' + \
+        b'"total_questions":' + provider.dumps(size) + b'}'
+
+
+def measure(render, repeat):
+    '''median milliseconds of repeat calls of render'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+    return statistics.median(timings)
+
+
+def report(size, name, milliseconds, baseline):
+    print('{:>7} {:<22} {:>9.3f} ms   x{:.1f}'.format(
+        size, name, milliseconds, baseline / milliseconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'serialization_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # engine options follow the database url, so set it before the app
+    os.environ['DATABASE_URL'] = database_url
+    app = create_app()
+
+    providers = [('json', {'JSON_PROVIDER': 'json'})]
+    if orjson is not None:
+        providers.append(('orjson', {'JSON_PROVIDER': 'orjson'}))
+
+    with app.test_request_context():
+        seed(max(args.pages))
+        for size in args.pages:
+            app.debug = False
+            baseline = measure(lambda: legacy_page(size), args.repeat)
+            report(size, 'orm + jsonify', baseline, baseline)
+            app.debug = True
+            report(size, 'orm + jsonify (debug)', measure(
+                lambda: legacy_page(size), args.repeat), baseline)
+            app.debug = False
+
+            for name, config in providers:
+                provider = JSONProvider()
+                provider.configure(config)
+
+                def cold():
+                    return rows_page(size, QuestionCache(), provider)
+                report(size, 'rows ({}, cold)'.format(name),
+                       measure(cold, args.repeat), baseline)
+
+                cache = QuestionCache(max(args.pages))
+                rows_page(size, cache, provider)
+                report(size, 'rows ({}, cached)'.format(name), measure(
+                    lambda: rows_page(size, cache, provider), args.repeat),
+                    baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+'''
+Load test of the WSGI and ASGI serving modes.
+
+Serves the same synthetic question bank with the threaded Flask server
+(create_app) and with uvicorn (flaskr.asgi), one at a time on this
+machine, and drives each with the same concurrent mix of GET /categories,
+GET /questions, GET /categories/<id>/questions and POST /quizzes,
+reporting requests/sec and p50/p99 latency. Run from the backend
+directory, with the packages of requirements-asgi.txt installed:
+
+    python -m benchmarks.serving_modes
+    python -m benchmarks.serving_modes --concurrency 64 --duration 30 \
+        --database-url postgresql://localhost/trivia_bench
+'''
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.quiz_selection import CATEGORIES, seed
+
+MODES = ('wsgi', 'asgi')
+
+
+def serve(mode, port):
+    '''runs the API in mode on port until killed'''
+    if mode == 'wsgi':
+        from flaskr import create_app
+        # a log line per request would be measured too
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        create_app().run(port=port, threaded=True, debug=False,
+                         use_reloader=False)
+    else:
+        import uvicorn
+        from flaskr.asgi import create_asgi_app
+        uvicorn.run(create_asgi_app(), port=port, log_level='warning')
+
+
+def requests_mix(pages):
+    '''yields (method, path, body) of the requests of the load test'''
+    while True:
+        category = random.randint(1, len(CATEGORIES))
+        yield 'GET', '/categories', None
+        yield 'GET', '/questions?page={}'.format(
+            random.randint(1, pages)), None
+        yield 'GET', '/categories/{}/questions'.format(category), None
+        yield 'POST', '/quizzes', json.dumps({
+            'quiz_category': {'id': category},
+            'previous_questions': []
+        })
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/categories')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+def load(port, concurrency, duration, mix):
+    '''(completed requests, errors, latencies in ms) of concurrency
+    clients keeping a connection each, for duration seconds, each
+    sending the (method, path, body) requests of its own mix()'''
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        timings, failed = [], 0
+        for method, path, body in mix():
+            if time.monotonic() >= deadline:
+                break
+            headers = {'Content-Type': 'application/json'} if body else {}
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def report(mode, completed, errors, timings, duration):
+    print('{:<5} {:>9.1f} req/s   p50 {:>8.2f} ms   p99 {:>8.2f} ms   '
+          '{} errors'.format(mode, completed / duration,
+                             percentile(timings, 0.5),
+                             percentile(timings, 0.99), errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--size', type=int, default=10000,
+                        help='questions in the synthetic bank')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load per mode')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary SQLite file')
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), 'serving_bench.db')
+        database_url = 'sqlite:///{}'.format(path)
+
+    # the servers read the database from the environment, as in production
+    os.environ['DATABASE_URL'] = database_url
+    from flaskr import create_app
+    app = create_app()
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    with app.app_context():
+        seed(args.size)
+
+    pages = max(1, args.size // 10)
+    for mode in args.modes:
+        server = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.serving_modes',
+            '--serve', mode, '--port', str(args.port)])
+        try:
+            wait_until_up(args.port)
+            completed, errors, timings = load(
+                args.port, args.concurrency, args.duration,
+                lambda: requests_mix(pages))
+            report(mode, completed, errors, timings, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
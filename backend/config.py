@@ -1,5 +1,7 @@
 import os
-SECRET_KEY = os.urandom(32)
+# set SECRET_KEY so every worker signs with the same key, create_app
+# makes a random one per process otherwise
+SECRET_KEY = os.environ.get('SECRET_KEY')
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -17,5 +19,103 @@ database_path = "postgresql://{}:{}@{}/{}".format(pg_user, pg_pass,'localhost:54
 # self.database_name = "trivia_test"
 # self.database_path = "postgres://{}:{}@{}/{}".format('postgres','chines2001','localhost:5432', self.database_name)
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = database_path
-SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', database_path)
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool and session settings for PostgreSQL, read from the
+# environment so each deployment can size them (see engine_options in
+# models.py). Every worker process opens up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds after which connections are replaced, -1 never
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# test connections before use so a restarted database is not noticed
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true') == 'true'
+# milliseconds a statement may run, 0 for no limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+DB_APPLICATION_NAME = os.environ.get('DB_APPLICATION_NAME', 'trivia-api')
+
+# Seconds the in-process category map may be served before it is reloaded
+# from the database (None keeps it until a category is written)
+CATEGORY_CACHE_TTL = None
+
+# Seconds the in-process question counts (total_questions, /stats) may
+# be used before they are reloaded, so other workers' writes are counted
+# (None keeps them)
+QUESTION_STATS_TTL = 10
+
+# Seconds the in-process quiz index may be used before it is reloaded, so
+# questions inserted by other workers become eligible (None keeps it)
+QUIZ_INDEX_TTL = 60
+
+# Where quiz sessions are kept: 'memory' (per worker) or a redis:// url
+# shared by every worker (requires the redis package)
+QUIZ_SESSION_STORE = 'memory'
+# Seconds an idle quiz session is kept, and how many a worker keeps
+QUIZ_SESSION_TTL = 3600
+QUIZ_SESSION_MAX = 10000
+
+# HTTP caching of GET /categories, /questions and
+# /categories/<id>/questions: Cache-Control max-age for clients and,
+# if set, s-maxage for shared caches (CDN, reverse proxy)
+HTTP_CACHE_MAX_AGE = 0
+HTTP_CACHE_SHARED_MAX_AGE = None
+# Where the data versions behind the ETags are kept: 'memory' is only
+# correct with a single worker process, a redis:// url is shared by
+# every worker. None makes the ETags hashes of the response bodies
+HTTP_CACHE_VERSION_STORE = None
+
+# Cache of the rendered question pages: None (off), 'memory' (per
+# worker, bounded to PAGE_CACHE_MAX_BYTES, only correct with a single
+# worker process) or a redis:// url shared by every worker, entries kept
+# PAGE_CACHE_TTL
+PAGE_CACHE_STORE = None
+PAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+PAGE_CACHE_TTL = 3600
+
+# Formatted questions kept per worker for batch lookups by id
+QUESTION_CACHE_SIZE = 10000
+
+# JSON encoder of the responses: 'auto' uses orjson when it is
+# installed, 'orjson' requires it, 'json' is the standard library
+JSON_PROVIDER = 'auto'
+
+# Per-request metrics (Server-Timing header, a JSON log line on the
+# 'flaskr.requests' logger, GET /metrics), off unless INSTRUMENTATION=true
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'false') == 'true'
+# requests sent with this value in an X-Profile header are profiled and
+# their folded stacks written to PROFILE_DIR (temp dir if unset); unset
+# disables profiling
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+# Run the startup phases (mappers, pool connections, caches and indexes)
+# in create_app, before the first request, instead of during it
+WARM_UP = os.environ.get('WARM_UP', 'true') == 'true'
+
+# Read replicas of the database, comma separated urls in
+# DATABASE_REPLICA_URLS. GET requests and the quiz selection read from
+# them in turn, skipping a replica for REPLICA_HEALTH_INTERVAL seconds
+# after a failed check. Reads stay on the primary for REPLICA_MAX_LAG
+# seconds after a write, in this worker and for the client that wrote
+SQLALCHEMY_REPLICA_URIS = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url]
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 5))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+
+# Keep every question in a compact in-memory column store and serve the
+# question pages and quizzes from it, per worker
+QUESTION_STORE = os.environ.get('QUESTION_STORE', 'false') == 'true'
+
+# Path of the shared question snapshot built by `flask snapshot build`,
+# mapped by every worker when set. Workers look for a new generation
+# every SNAPSHOT_CHECK_INTERVAL seconds; with SNAPSHOT_REBUILD_DELAY set,
+# a worker rebuilds the snapshot that many seconds after a write
+QUESTION_SNAPSHOT = os.environ.get('QUESTION_SNAPSHOT')
+SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('SNAPSHOT_CHECK_INTERVAL', 1))
+SNAPSHOT_REBUILD_DELAY = float(os.environ['SNAPSHOT_REBUILD_DELAY']) \
+    if os.environ.get('SNAPSHOT_REBUILD_DELAY') else None
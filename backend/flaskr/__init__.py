@@ -1,28 +1,167 @@
 import os
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, request, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
-import random
-from models import setup_db, Question, Category
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, setup_db, pool_status, question_stats, \
+    read_questions, replicas, Question, Category
+from .categories import category_registry
+from .quiz import quiz_index, make_session_store, parse_weights
+from .search import search_questions, inverted_index
+from .bulk import BulkImportError, import_questions, export_questions
+from .httpcache import cacheable, data_versions
+from .pagecache import page_cache, splice_json
+from .questioncache import question_cache
+from .store import question_store
+from .snapshot import question_snapshot
+from .serialize import json_provider, json_response
+from .instrumentation import instrumentation, report_swallowed
+from .startup import startup
+from .routing import init_replica_routing, reads_from_replica
 
 # maximum amount of questions per page to be returned
 QUESTIONS_PER_PAGE = 10
 
+# default and maximum amount of suggestions returned by /questions/suggest
+SUGGESTIONS_LIMIT = 10
+MAX_SUGGESTIONS_LIMIT = 50
+
+# maximum amount of ids of a batch lookup of questions
+MAX_BATCH_IDS = 500
+
+# default and maximum amount of questions of a generated quiz
+QUIZ_SIZE = 10
+MAX_QUIZ_SIZE = 100
+
 '''
+paginate(request, selection)
+    the results of the requested page of an ordered query of questions,
+    read_questions() records on read paths. ?page=N applies LIMIT/OFFSET,
+    ?after_id=N seeks past the given question id so deep pages cost the
+    same as the first one
 paginate_questions(request, selection)
-    paginates the list of questions
+    the formatted questions of the requested page. only the questions on
+    that page are loaded and formatted
 '''
 
 
+def paginate(request, selection):
+    after_id = request.args.get('after_id', None, type=int)
+
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return []
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    return selection.limit(QUESTIONS_PER_PAGE).all()
+
+
 def paginate_questions(request, selection):
+    return [question.format() for question in paginate(request, selection)]
+
+
+'''
+prefers_minimal(request)
+    whether a write asked for a lean response, with ?return=minimal
+    or a "Prefer: return=minimal" header
+minimal_response(payload, status=200)
+    the lean response, acknowledging the preference
+'''
+
+
+def prefers_minimal(request):
+    prefer = request.headers.get('Prefer', '')
+    return request.args.get('return') == 'minimal' or \
+        'return=minimal' in [p.strip() for p in prefer.split(',')]
+
+
+def minimal_response(payload, status=200):
+    response = json_response(payload, status)
+    response.headers['Preference-Applied'] = 'return=minimal'
+    return response
+
+
+'''
+questions_page(request, scope, selection, category=None)
+    serialized JSON array of the requested page of selection, from the
+    rendered page cache unless the page is requested with ?after_id=.
+    pages are rendered from QuestionRecord tuples, reusing the cached
+    encoding of each question. with a question snapshot mapped, or the
+    question store enabled, the records come from them, selection must
+    then be the questions (of category) in id order
+'''
+
+
+def questions_page(request, scope, selection, category=None):
+    def render():
+        generation = question_cache.generation
+        snapshot = question_snapshot.current()
+        source = snapshot if snapshot is not None else \
+            question_store if question_store.enabled else None
+        if source is not None:
+            records = source.page(
+                category, request.args.get('page', 1, type=int),
+                request.args.get('after_id', None, type=int),
+                QUESTIONS_PER_PAGE)
+        else:
+            records = paginate(request, selection)
+        return question_cache.encode_rows(records, generation)
+
+    if 'after_id' in request.args:
+        return render()
+
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    return page_cache.page(scope, page, render)
+
+
+'''
+parse_ids(value)
+    list of question ids from a JSON list or a comma separated string,
+    raising ValueError when it is empty, too long or not made of ids
+questions_by_id(ids)
+    the response of a batch lookup: the formatted questions, in the order
+    of ids, from the identity cache or a single query, and the missing ids
+'''
+
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+def parse_ids(value):
+    if isinstance(value, str):
+        value = [item for item in value.split(',') if item.strip()]
+    if not isinstance(value, list):
+        raise ValueError('expected a list of ids')
+    ids = [int(item) for item in value]
+    if not 0 < len(ids) <= MAX_BATCH_IDS:
+        raise ValueError('expected 1 to {} ids'.format(MAX_BATCH_IDS))
+    return ids
 
-    return current_questions
+
+def questions_by_id(ids):
+    questions, missing = question_cache.get_many(ids)
+    return json_response({
+        "success": True,
+        "questions": questions,
+        "missing": missing,
+        "total_questions": len(questions)
+    })
+
+
+'''
+parse_category_id(quiz_category)
+    the category id of a quiz's quiz_category, 0 for all categories and
+    None when it has none. the frontend sends ids as strings, raises
+    ValueError when it is not a number
+'''
+
+
+def parse_category_id(quiz_category):
+    category_id = quiz_category.get('id')
+    if category_id is None or category_id == '':
+        return None
+    return int(category_id)
 
 # Initialising flask app
 
@@ -31,6 +170,22 @@ def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
     setup_db(app)
+    if test_config is not None:
+        app.config.update(test_config)
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.urandom(32)
+    category_registry.ttl = app.config.get('CATEGORY_CACHE_TTL')
+    quiz_index.ttl = app.config.get('QUIZ_INDEX_TTL', 60)
+    question_stats.ttl = app.config.get('QUESTION_STATS_TTL', 10)
+    quiz_sessions = make_session_store(app.config)
+    data_versions.configure(app.config)
+    page_cache.configure(app.config, QUESTIONS_PER_PAGE)
+    question_cache.configure(app.config)
+    question_store.configure(app.config)
+    question_snapshot.init_app(app)
+    json_provider.configure(app.config)
+    init_replica_routing(app)
+    instrumentation.init_app(app)
     '''
     @DONE: Set up CORS. Allow '*' for origins.
     Delete the sample route after completing the DONEs
@@ -40,6 +195,17 @@ def create_app(test_config=None):
             r"/categories/*": {"origins": "*"},
             r"/quizzes/*": {"origins": "*"}
         })
+    # cli commands such as flask db upgrade do not serve requests, flask run
+    # warms up on its first request
+    if app.config.get('WARM_UP', True) and \
+            click.get_current_context(silent=True) is None:
+        startup.warm_up(app)
+
+    @app.before_first_request
+    def build_indexes():
+        """Load the caches and indexes now if create_app did not"""
+        startup.warm_up(app)
+
     '''
     @DONE: Use the after_request decorator to set Access-Control-Allow
     '''
@@ -61,20 +227,14 @@ def create_app(test_config=None):
     for all available categories.
     '''
     @app.route('/categories')
+    @cacheable()
     def get_categories():
         """Get all categories formatted as {1: 'Science', 2: 'Geography'}"""
-        categories = Category.query.order_by(Category.id).all()
-        if not categories:
+        response = category_registry.response()
+        if response is None:
             abort(404)
 
-        categories_formatted = {}
-        for category in categories:
-            categories_formatted[category.id] = category.type
-
-        return jsonify({
-            "success": True,
-            "categories": categories_formatted
-        })
+        return response
 
     '''
     @DONE:
@@ -90,36 +250,120 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     '''
     @app.route('/questions')
+    @cacheable(lambda: ('categories', 'questions'))
     def retrieve_all_questions():
         """Get all categories formatted as {1: 'Science', 2: 'Geography'}"""
-        categories = Category.query.order_by(Category.id).all()
-        categories_formatted = {}
+        if 'ids' in request.args:
+            # ?ids=1,5,9 looks up those questions instead of a page
+            try:
+                ids = parse_ids(request.args['ids'])
+            except ValueError:
+                abort(400)
+            return questions_by_id(ids)
+
+        categories_formatted = category_registry.categories()
         current_category = None
         try:
-            if not categories:
+            if not categories_formatted:
                 abort(404)
 
-            for category in categories:
-                categories_formatted[category.id] = category.type
-
             # Paginate questions
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection)
+            selection = read_questions().order_by(Question.id)
+            current_questions = questions_page(
+                request, 'questions', selection)
 
             # resource not found
-            if not current_questions:
+            if current_questions == b'[]':
                 abort(404)
 
-            return jsonify({
+            return Response(splice_json({
                     "success": True,
-                    "questions": current_questions,
-                    "total_questions": len(selection),
+                    "total_questions": Question.count(),
                     "categories": categories_formatted,
                     "current_category": current_category
-                })
+                }, {
+                    "questions": current_questions
+                }), mimetype='application/json')
         except:
+            report_swallowed()
             abort(404)
 
+    '''
+    Typeahead suggestions for the search box, served from the in-memory
+    question index without touching the database
+    '''
+    @app.route('/questions/suggest')
+    def suggest_questions():
+        text = request.args.get('q')
+        limit = request.args.get('limit', SUGGESTIONS_LIMIT, type=int)
+        if text is None or not 0 < limit <= MAX_SUGGESTIONS_LIMIT:
+            abort(400)
+
+        return json_response({
+            "success": True,
+            "suggestions": inverted_index.suggest(text, limit)
+        })
+
+    '''
+    Bulk import of questions from an NDJSON (one JSON object per line)
+    or CSV (with a header line) request body. Every row is inserted in
+    one transaction, questions already in their category are skipped
+    '''
+    @app.route('/questions/bulk', methods=['POST'])
+    def import_bulk_questions():
+        content_type = request.mimetype
+        if content_type not in ('application/x-ndjson', 'text/csv'):
+            abort(415)
+
+        try:
+            read, inserted = import_questions(
+                request.stream, content_type,
+                category_registry.categories())
+        except BulkImportError as error:
+            return json_response({
+                "success": False,
+                "error": 400,
+                "message": "bad request",
+                "line": error.line,
+                "reason": error.reason
+            }), 400
+        except (SQLAlchemyError, UnicodeDecodeError):
+            report_swallowed()
+            abort(422)
+
+        return json_response({
+            "success": True,
+            "inserted": inserted,
+            "skipped": read - inserted,
+            "total_questions": Question.count()
+        }), 201
+
+    '''
+    Batch lookup of the questions of a JSON {"ids": [...]} body, for id
+    lists too long for GET /questions?ids=
+    '''
+    @app.route('/questions/batch', methods=['POST'])
+    def batch_questions():
+        body = request.get_json() or {}
+        try:
+            ids = parse_ids(body.get('ids'))
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        return questions_by_id(ids)
+
+    '''
+    Export of every question, or those of ?category=, as NDJSON
+    streamed from a server-side cursor
+    '''
+    @app.route('/questions/export')
+    def export_all_questions():
+        category = request.args.get('category', None, type=int)
+
+        return Response(
+            stream_with_context(export_questions(category)),
+            mimetype='application/x-ndjson')
+
     '''
     @DONE:
     Create an endpoint to DELETE question using a question ID.
@@ -130,36 +374,40 @@ def create_app(test_config=None):
     '''
     @app.route('/questions/<int:id>', methods=['DELETE'])
     def remove_a_question(id):
-        # fetch the question object
-        question = Question.query.filter(Question.id == id).one_or_none()
-
         try:
-            if question is None:
+            # delete without loading the question first
+            current_category = Question.delete_by_id(id)
+            if current_category is None:
                 abort(404)
 
-            question.delete()
+            if prefers_minimal(request):
+                return minimal_response({
+                    "success": True,
+                    "deleted": id,
+                    "total_questions": Question.count(current_category),
+                    "current_category": current_category
+                })
 
             # update the view with the correct questions after deleting
-            categories = Category.query.order_by(Category.id).all()
-            categories_ids = [category.id for category in categories]
-            current_category = question.category
+            categories_ids = list(category_registry.categories())
 
             # paginate the list of questions
-            selection = Question.query\
+            selection = read_questions()\
                 .filter(Question.category == current_category)\
-                .order_by(Question.id).all()
+                .order_by(Question.id)
             current_questions = paginate_questions(request, selection)
 
-            return jsonify({
+            return json_response({
                 "success": True,
-                "deleted": question.id,
+                "deleted": id,
                 "questions": current_questions,
-                "total_questions": len(selection),
+                "total_questions": Question.count(current_category),
                 "categories": categories_ids,
                 "current_category": current_category
             })
 
         except:
+            report_swallowed()
             abort(404)
     '''
     @DONE:
@@ -190,17 +438,16 @@ def create_app(test_config=None):
         in the database
         '''
         if search_term:
-            search_term_formatted = "%{}%".format(search_term)
+            # ranked full-text search, paginated in the database
+            page = request.args.get('page', 1, type=int)
+            current_questions, total_questions = search_questions(
+                search_term, page, QUESTIONS_PER_PAGE,
+                include_answers=bool(body.get('searchAnswers')))
 
-            # Query the database using the searhterm_formatted
-            questions = Question.query\
-                .filter(Question.question.ilike(search_term_formatted)).all()
-            current_questions = paginate_questions(request, questions)
-
-            return jsonify({
+            return json_response({
                 "success": True,
                 "questions": current_questions,
-                "total_questions": len(questions)
+                "total_questions": total_questions
             })
 
         else:
@@ -217,44 +464,49 @@ def create_app(test_config=None):
                new_category and new_difficulty):
                 abort(400)
 
-            # lookup db to ensure no duplicate question
-            check_question = Question.query\
-                .filter(Question.question == new_question)\
-                .filter(Question.category == new_category).one_or_none()
-
-            if check_question is None:
-                try:
-                    question = Question(
-                        question=new_question, answer=new_answer,
-                        category=new_category, difficulty=new_difficulty)
-
-                    question.insert()
-
-                    # update the frontend after adding a question successfully
-                    current_category = question.category
-                    categories = Category.query.order_by(Category.id).all()
-                    categories_ids = [category.id for category in categories]
-
-                    # paginate list of questions
-                    selection = Question.query\
-                        .filter(Question.category == current_category)\
-                        .order_by(Question.id).all()
-                    current_questions = paginate_questions(request, selection)
-
-                    return jsonify({
-                        "success": True,
-                        "questions": current_questions,
-                        "total_questions": len(selection),
-                        "categories": categories_ids,
-                        "current_category": current_category,
-                        "created": question.id
-                    }), 201
-
-                except:
-                    abort(422)
-            else:
+            try:
+                question = Question(
+                    question=new_question, answer=new_answer,
+                    category=int(new_category),
+                    difficulty=int(new_difficulty))
+
+                # a single INSERT ... ON CONFLICT, nothing is inserted
+                # if the category already has this question
+                created = question.insert_unique()
+            except:
+                report_swallowed()
+                abort(422)
+
+            if not created:
                 abort(422)
 
+            current_category = question.category
+            if prefers_minimal(request):
+                return minimal_response({
+                    "success": True,
+                    "created": question.id,
+                    "total_questions": Question.count(current_category),
+                    "current_category": current_category
+                }, 201)
+
+            # update the frontend after adding a question successfully
+            categories_ids = list(category_registry.categories())
+
+            # paginate list of questions
+            selection = read_questions()\
+                .filter(Question.category == current_category)\
+                .order_by(Question.id)
+            current_questions = paginate_questions(request, selection)
+
+            return json_response({
+                "success": True,
+                "questions": current_questions,
+                "total_questions": Question.count(current_category),
+                "categories": categories_ids,
+                "current_category": current_category,
+                "created": question.id
+            }), 201
+
     '''
     @DONE:
     Create a POST endpoint to get questions based on a search term.
@@ -275,27 +527,29 @@ def create_app(test_config=None):
     category to be shown.
     '''
     @app.route('/categories/<int:id>/questions')
+    @cacheable(lambda id: ('categories', 'questions:*',
+                           'questions:{}'.format(id)))
     def retrieve_questions_categories(id):
         '''fetch list of questions in a specified category(id)
         and paginate the result'''
 
         # check if category available
-        category = Category.query.filter(Category.id == id).one_or_none()
-
-        if category is None:
+        if id not in category_registry.categories():
             abort(404)
 
         else:
-            selection = Question.query\
-                .filter(Question.category == id).order_by(Question.id).all()
-            questions = paginate_questions(request, selection)
+            selection = read_questions()\
+                .filter(Question.category == id).order_by(Question.id)
+            questions = questions_page(
+                request, 'category:{}'.format(id), selection, id)
 
-            return jsonify({
+            return Response(splice_json({
                 "success": True,
-                "questions": questions,
-                "total_questions": len(selection),
+                "total_questions": Question.count(id),
                 "current_category": id
-            })
+            }, {
+                "questions": questions
+            }), mimetype='application/json')
 
     '''
     @DONE:
@@ -309,56 +563,228 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     '''
     @app.route('/quizzes', methods=['POST'])
+    @reads_from_replica
     def trivia_quiz():
         body = request.get_json()
 
         previous_questions = body.get('previous_questions')
-        quiz_category = body.get('quiz_category')
+        try:
+            category_id = parse_category_id(body.get('quiz_category', {}))
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
 
         try:
             # check if previous_questoins is available
             if previous_questions is None:
                 abort(404)
 
-            # Select all questions in the database
-            if quiz_category['id'] == 0:
-                questions = Question.query\
-                    .filter(~Question.id.in_(previous_questions)).all()
+            # 0 selects questions from all categories
+            if category_id is None or category_id != 0 and \
+                    category_id not in category_registry.categories():
+                abort(404)
 
-            # Select questions within a specified category(quiz_category)
-            else:
-                questions = Question.query\
-                    .filter(Question.category == quiz_category['id'])\
-                    .filter(~Question.id.in_(previous_questions)).all()
+            # pick a random question not in previous_questions from the
+            # in-memory id index, fetching only that question
+            question = quiz_index.next_question(
+                category_id or None, previous_questions)
 
             # Check for questions in selected category
-            if not questions:
-                return jsonify({
+            if question is None:
+                return json_response({
                     "success": True
                 })
 
-            # randomize the questions
-            random.shuffle(questions)
-
-            # return first question of the reshuffled list of questions
-            current_question = questions[0].format()
+            current_question = question.format()
 
             # update the list of previous questions
             previous_questions.append(current_question['id'])
 
-            return jsonify({
+            return json_response({
                     "success": True,
                     "question": current_question,
                     "previous_questions": previous_questions
                 })
         except:
+            report_swallowed()
+            abort(404)
+
+    '''
+    A whole quiz in one request: size questions sampled from the
+    in-memory (category, difficulty) indexes in proportion to the
+    requested category and difficulty weights, reproducible from the
+    returned seed
+    '''
+    @app.route('/quizzes/generate', methods=['POST'])
+    @reads_from_replica
+    def generate_quiz():
+        body = request.get_json() or {}
+
+        try:
+            size = int(body.get('size', QUIZ_SIZE))
+            categories = parse_weights(body.get('categories'))
+            difficulties = parse_weights(body.get('difficulties'))
+            seed = body.get('seed')
+            if seed is not None:
+                seed = int(seed)
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        if not 0 < size <= MAX_QUIZ_SIZE:
+            abort(400)
+        if categories and not set(categories) <= \
+                set(category_registry.categories()):
+            abort(404)
+
+        seed, ids = quiz_index.generate(size, categories, difficulties, seed)
+        # not enough questions of the requested categories and difficulties
+        if len(ids) < size:
+            abort(422)
+
+        questions, missing = question_cache.get_many(ids)
+
+        return json_response({
+            "success": True,
+            "seed": seed,
+            "questions": questions,
+            "total_questions": len(questions)
+        })
+
+    '''
+    Quiz sessions keep the questions already served on the server,
+    so clients only send the session id to get the next question
+    '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        body = request.get_json() or {}
+        try:
+            category_id = parse_category_id(
+                body.get('quiz_category') or {'id': 0})
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        # 0 selects questions from all categories
+        if category_id is None or category_id != 0 and \
+                category_id not in category_registry.categories():
+            abort(404)
+
+        session_id = quiz_sessions.create(category_id or None)
+
+        return json_response({
+            "success": True,
+            "session_id": session_id,
+            "total_questions": Question.count(category_id or None)
+        }), 201
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        session = quiz_sessions.get(session_id)
+        if session is None:
             abort(404)
 
+        category, served = session
+        while True:
+            question = quiz_index.next_question(category, served)
+            if question is None:
+                # every question in the category has been served
+                return json_response({
+                    "success": True,
+                    "served": len(served)
+                })
+
+            # another request of this session may have served it already
+            if quiz_sessions.add_served(session_id, question.id):
+                break
+            served.add(question.id)
+
+        return json_response({
+            "success": True,
+            "question": question.format(),
+            "served": len(served) + 1
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.delete(session_id):
+            abort(404)
+
+        return json_response({
+            "success": True,
+            "deleted": session_id
+        })
+
+    '''
+    Question totals by category, by difficulty and by both, from the
+    in-memory counters. ?category= and ?difficulty= narrow
+    total_questions, e.g. to the hard questions of one category
+    '''
+    @app.route('/stats')
+    def get_stats():
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+
+        stats = question_stats.summary()
+        stats.update({
+            "success": True,
+            "total_questions": Question.count(category, difficulty),
+            "current_category": category,
+            "current_difficulty": difficulty
+        })
+        return json_response(stats)
+
+    '''
+    Connection pool state and checkout wait times, to size
+    DB_POOL_SIZE and DB_MAX_OVERFLOW from data
+    '''
+    @app.route('/pool')
+    def get_pool_status():
+        return json_response({
+            "success": True,
+            "pool": pool_status(),
+            "replicas": replicas.replica_set(app).status()
+        })
+
+    '''
+    Liveness and readiness probes. /healthz answers as long as the process
+    serves requests, /readyz once the startup phases have run and the
+    database answers, with the time each phase took
+    '''
+    @app.route('/healthz')
+    def healthz():
+        return json_response({"success": True})
+
+    @app.route('/readyz')
+    def readyz():
+        status = startup.status()
+        try:
+            db.session.execute('SELECT 1', bind=db.get_engine())
+            database = True
+        except Exception:
+            app.logger.exception('readiness check failed')
+            database = False
+        ready = status['ready'] and database
+        return json_response(dict(status, success=ready, ready=ready,
+                                  database=database),
+                             200 if ready else 503)
+
+    '''
+    Hit, miss and eviction counters of the rendered page cache and of
+    the question identity cache
+    '''
+    @app.route('/cache')
+    def get_cache_stats():
+        return json_response({
+            "success": True,
+            "page_cache": page_cache.stats(),
+            "question_cache": question_cache.stats(),
+            "question_store": question_store.stats(),
+            "question_snapshot": question_snapshot.stats()
+        })
+
     # Error Handling
     '''
     @DONE implement error handlers using the @app.errorhandler(error) decorator
         each error handler should return (with approprate messages):
-                jsonify({
+                json_response({
                         "success": False,
                         "error": 404,
                         "message": "resource not found"
@@ -371,7 +797,7 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "bad request",
             "error": 400
@@ -383,7 +809,7 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(401)
     def unauthorized(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "unauthorized",
             "error": 401
@@ -395,7 +821,7 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "resource not found",
             "error": 404
@@ -407,19 +833,30 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(405)
     def not_allowed(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "method not allowed",
             "error": 405
             }), 405
 
+    '''
+    error handler for 415, for bodies in an unsupported format
+    '''
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        return json_response({
+            "success": False,
+            "message": "unsupported media type",
+            "error": 415
+            }), 415
+
     '''
     @DONE implement error handler for 422
         error handler should conform to general task above
     '''
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "unprocessable",
             "error": 422
@@ -431,7 +868,7 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(500)
     def server_error(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "internal server error",
             "error": 500
@@ -443,7 +880,7 @@ def create_app(test_config=None):
     '''
     @app.errorhandler(503)
     def service_unavailable(error):
-        return jsonify({
+        return json_response({
             "success": False,
             "message": "service unavailable",
             "error": 503
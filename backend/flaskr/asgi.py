@@ -0,0 +1,434 @@
+import itertools
+import os
+import re
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from sqlalchemy.engine.url import make_url
+from werkzeug.http import generate_etag, parse_etags
+from . import create_app, parse_category_id, parse_ids, \
+    QUESTIONS_PER_PAGE
+from models import question_stats, QuestionRecord
+from .categories import category_registry
+from .quiz import quiz_index
+from .httpcache import data_versions
+from .pagecache import page_cache, splice_json
+from .questioncache import question_cache, in_order
+from .serialize import json_provider
+
+try:
+    from starlette.applications import Starlette
+    from starlette.exceptions import HTTPException
+    from starlette.responses import Response
+    from starlette.routing import Mount, Route
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    Starlette = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+'''
+ASGI entry point
+    serves the API on an ASGI server (uvicorn --factory
+    flaskr.asgi:create_asgi_app). the read endpoints clients poll the
+    most (/categories, /questions, /categories/<id>/questions and
+    /quizzes) are native coroutines querying the database through an
+    async driver (asyncpg for PostgreSQL, aiosqlite for SQLite), so a
+    worker keeps serving while they wait on the database. every other
+    route is the Flask app of create_app, run in a thread pool.
+    both halves share the in-process indexes and caches, so writes made
+    through Flask invalidate what the async routes serve
+'''
+
+ERROR_MESSAGES = {
+    400: 'bad request',
+    401: 'unauthorized',
+    404: 'resource not found',
+    405: 'method not allowed',
+    415: 'unsupported media type',
+    422: 'unprocessable',
+    500: 'internal server error',
+    503: 'service unavailable'
+}
+
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+
+
+class AsyncDatabase(object):
+    """Minimal async access to the database of a SQLAlchemy URL.
+    Statements use '?' placeholders and rows are tuples. Relative SQLite
+    paths are resolved against root_path, as Flask-SQLAlchemy does"""
+
+    def __init__(self, url, pool_size=5, root_path=''):
+        self.url = url
+        self.root_path = root_path
+        self.pool_size = pool_size
+        self.postgres = url.startswith(('postgres://', 'postgresql://'))
+        self._pool = None
+        self._connection = None
+
+    async def connect(self):
+        if self.postgres:
+            if asyncpg is None:
+                raise RuntimeError('the asyncpg package is required for {}'
+                                   .format(self.url))
+            self._pool = await asyncpg.create_pool(
+                self.url, min_size=1, max_size=self.pool_size)
+        elif self.url.startswith('sqlite://'):
+            if aiosqlite is None:
+                raise RuntimeError('the aiosqlite package is required for '
+                                   '{}'.format(self.url))
+            path = make_url(self.url).database
+            if path in (None, '', ':memory:'):
+                path = ':memory:'
+            else:
+                path = os.path.join(self.root_path, path)
+            self._connection = await aiosqlite.connect(path)
+        else:
+            raise RuntimeError('no async driver for {}'.format(self.url))
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def fetch(self, statement, *parameters):
+        if self.postgres:
+            numbers = itertools.count(1)
+            statement = re.sub(
+                r'\?', lambda match: '${}'.format(next(numbers)), statement)
+            async with self._pool.acquire() as connection:
+                return [tuple(row) for row in
+                        await connection.fetch(statement, *parameters)]
+
+        async with self._connection.execute(statement, parameters) as cursor:
+            return await cursor.fetchall()
+
+
+def _int_arg(request, name, default=None):
+    '''query argument name as an int, default when missing or invalid'''
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+class AsyncRoutes(object):
+    """The native async routes, with the same responses as the views of
+    the same paths in create_app"""
+
+    def __init__(self, app, database):
+        self.config = app.config
+        self.db = database
+
+    def respond(self, body=b'', status=200, etag=None, cacheable=False):
+        response = Response(body, status_code=status,
+                            media_type='application/json')
+        response.headers['Access-Control-Allow-Headers'] = \
+            'Content-Type, Authorization,true'
+        response.headers['Access-Control-Allow-Methods'] = \
+            'GET,PUT,POST,DELETE,OPTIONS'
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        if etag is not None:
+            response.headers['ETag'] = '"{}"'.format(etag)
+        if cacheable:
+            cache_control = 'public, max-age={}'.format(
+                self.config.get('HTTP_CACHE_MAX_AGE', 0))
+            shared_max_age = self.config.get('HTTP_CACHE_SHARED_MAX_AGE')
+            if shared_max_age is not None:
+                cache_control += ', s-maxage={}'.format(shared_max_age)
+            response.headers['Cache-Control'] = cache_control
+        return response
+
+    def not_modified(self, request, etag):
+        return parse_etags(request.headers.get('if-none-match'))\
+            .contains(etag)
+
+    def versioned_etag(self, request, keys):
+        '''ETag of the data versions keys, as the cacheable decorator,
+        None without a version store'''
+        full_path = '{}?{}'.format(request.url.path, request.url.query)
+        return data_versions.etag(full_path, keys)
+
+    def respond_cacheable(self, request, body, etag):
+        '''response of body with etag, or as the cacheable decorator
+        without a version store, a hash of body answered 304 when
+        If-None-Match holds it'''
+        if etag is None:
+            etag = generate_etag(body)
+            if self.not_modified(request, etag):
+                return self.respond(status=304, etag=etag, cacheable=True)
+        return self.respond(body, etag=etag, cacheable=True)
+
+    async def categories_snapshot(self):
+        snapshot = category_registry.current()
+        if snapshot is not None:
+            return snapshot
+        rows = await self.db.fetch(
+            'SELECT id, type FROM categories ORDER BY id')
+        return category_registry.load_rows(rows)
+
+    async def quiz_ids(self):
+        ids = quiz_index.current()
+        if ids is not None:
+            return ids
+        rows = await self.db.fetch(
+            'SELECT id, category, difficulty FROM questions ORDER BY id')
+        return quiz_index.load_rows(rows)
+
+    async def question_counts(self):
+        counts = question_stats.current()
+        if counts is not None:
+            return counts
+        rows = await self.db.fetch(
+            'SELECT category, difficulty, COUNT(*) FROM questions '
+            'GROUP BY category, difficulty')
+        return question_stats.load_rows(rows)
+
+    async def render_page(self, category, after_id, page):
+        if after_id is None and page < 1:
+            return b'[]'
+
+        conditions, parameters = [], []
+        if category is not None:
+            conditions.append('category = ?')
+            parameters.append(category)
+        if after_id is not None:
+            conditions.append('id > ?')
+            parameters.append(after_id)
+            page = 1
+
+        statement = 'SELECT {} FROM questions'.format(QUESTION_COLUMNS)
+        if conditions:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        statement += ' ORDER BY id LIMIT ? OFFSET ?'
+        parameters += [QUESTIONS_PER_PAGE, (page - 1) * QUESTIONS_PER_PAGE]
+
+        generation = question_cache.generation
+        rows = await self.db.fetch(statement, *parameters)
+        return question_cache.encode_rows(rows, generation)
+
+    async def questions_page(self, request, scope, category=None):
+        '''serialized page, from the rendered page cache unless the page
+        is requested with ?after_id='''
+        if 'after_id' in request.query_params:
+            return await self.render_page(
+                category, _int_arg(request, 'after_id'),
+                _int_arg(request, 'page', 1))
+
+        page = _int_arg(request, 'page', 1)
+        body = page_cache.lookup(scope, page)
+        if body is None:
+            generation = page_cache.generation
+            body = await self.render_page(category, None, page)
+            page_cache.store(scope, page, body, generation)
+        return body
+
+    async def questions_by_id(self, value):
+        '''batch lookup of ?ids=, as questions_by_id of create_app'''
+        try:
+            ids = list(OrderedDict.fromkeys(parse_ids(value)))
+        except ValueError:
+            raise HTTPException(400)
+
+        found, wanted = question_cache.lookup(ids)
+        if wanted:
+            generation = question_cache.generation
+            statement = 'SELECT {} FROM questions WHERE '.format(
+                QUESTION_COLUMNS)
+            if self.db.postgres:
+                rows = await self.db.fetch(statement + 'id = ANY(?)', wanted)
+            else:
+                rows = await self.db.fetch(statement + 'id IN ({})'.format(
+                    ', '.join('?' * len(wanted))), *wanted)
+            found.update(question_cache.store(rows, generation))
+
+        questions, missing = in_order(ids, found)
+        return json_provider.dumps({
+            "success": True,
+            "questions": questions,
+            "missing": missing,
+            "total_questions": len(questions)
+        })
+
+    async def get_categories(self, request):
+        categories, body, etag, loaded_at = await self.categories_snapshot()
+        if not categories:
+            raise HTTPException(404)
+
+        if self.not_modified(request, etag):
+            return self.respond(status=304, etag=etag, cacheable=True)
+        return self.respond(body, etag=etag, cacheable=True)
+
+    async def retrieve_all_questions(self, request):
+        etag = self.versioned_etag(request, ('categories', 'questions'))
+        if etag is not None and self.not_modified(request, etag):
+            return self.respond(status=304, etag=etag, cacheable=True)
+
+        if 'ids' in request.query_params:
+            # ?ids=1,5,9 looks up those questions instead of a page
+            return self.respond_cacheable(request, await self.questions_by_id(
+                request.query_params['ids']), etag)
+
+        categories = (await self.categories_snapshot())[0]
+        if not categories:
+            raise HTTPException(404)
+
+        counts = await self.question_counts()
+        questions = await self.questions_page(request, 'questions')
+        if questions == b'[]':
+            raise HTTPException(404)
+
+        return self.respond_cacheable(request, splice_json({
+            "success": True,
+            "total_questions": question_stats.count(counts=counts),
+            "categories": categories,
+            "current_category": None
+        }, {
+            "questions": questions
+        }), etag)
+
+    async def retrieve_questions_categories(self, request):
+        category_id = request.path_params['id']
+        etag = self.versioned_etag(request, (
+            'categories', 'questions:*', 'questions:{}'.format(category_id)))
+        if etag is not None and self.not_modified(request, etag):
+            return self.respond(status=304, etag=etag, cacheable=True)
+
+        if category_id not in (await self.categories_snapshot())[0]:
+            raise HTTPException(404)
+
+        counts = await self.question_counts()
+        questions = await self.questions_page(
+            request, 'category:{}'.format(category_id), category_id)
+
+        return self.respond_cacheable(request, splice_json({
+            "success": True,
+            "total_questions": question_stats.count(
+                category_id, counts=counts),
+            "current_category": category_id
+        }, {
+            "questions": questions
+        }), etag)
+
+    async def next_question(self, category, exclude):
+        exclude = set(exclude)
+        while True:
+            question_id = quiz_index.choose(
+                category, exclude, await self.quiz_ids())
+            if question_id is None:
+                return None
+
+            rows = await self.db.fetch(
+                'SELECT {} FROM questions WHERE id = ?'
+                .format(QUESTION_COLUMNS), question_id)
+            if rows:
+                return QuestionRecord(*rows[0]).format()
+            # deleted by another worker
+            exclude.add(question_id)
+
+    async def trivia_quiz(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(400)
+
+        try:
+            previous_questions = body.get('previous_questions')
+            quiz_category = body.get('quiz_category', {})
+        except AttributeError:
+            raise HTTPException(404)
+        try:
+            category_id = parse_category_id(quiz_category)
+        except (AttributeError, TypeError, ValueError):
+            raise HTTPException(400)
+
+        if not isinstance(previous_questions, list):
+            raise HTTPException(404)
+
+        # 0 selects questions from all categories
+        if category_id is None or category_id != 0 and \
+                category_id not in (await self.categories_snapshot())[0]:
+            raise HTTPException(404)
+
+        question = await self.next_question(
+            category_id or None, previous_questions)
+        if question is None:
+            return self.respond(json_provider.dumps({"success": True}))
+
+        previous_questions.append(question['id'])
+        return self.respond(json_provider.dumps({
+            "success": True,
+            "question": question,
+            "previous_questions": previous_questions
+        }))
+
+    async def error(self, request, exc):
+        status = getattr(exc, 'status_code', 500)
+        if status not in ERROR_MESSAGES:
+            status = 500
+        return self.respond(json_provider.dumps({
+            "success": False,
+            "message": ERROR_MESSAGES[status],
+            "error": status
+        }), status)
+
+
+def _terminated_input(wsgi_app):
+    '''a2wsgi's wsgi.input ends with the request body, but its
+    readline(limit), which Werkzeug's length-limited stream uses, can
+    return nothing before the body arrives. flagging the input as
+    terminated lets Werkzeug read it directly'''
+    def app(environ, start_response):
+        environ['wsgi.input_terminated'] = True
+        return wsgi_app(environ, start_response)
+    return app
+
+
+'''
+create_asgi_app(app=None)
+    ASGI application serving app, a Flask app of create_app() by default
+'''
+
+
+def create_asgi_app(app=None):
+    if Starlette is None:
+        raise RuntimeError('the ASGI mode requires the packages of '
+                           'requirements-asgi.txt')
+    if app is None:
+        app = create_app()
+
+    database = AsyncDatabase(app.config['SQLALCHEMY_DATABASE_URI'],
+                             app.config.get('DB_POOL_SIZE', 5),
+                             app.root_path)
+    routes = AsyncRoutes(app, database)
+
+    @asynccontextmanager
+    async def lifespan(asgi_app):
+        await database.connect()
+        await routes.categories_snapshot()
+        await routes.quiz_ids()
+        await routes.question_counts()
+        yield
+        await database.close()
+
+    return Starlette(routes=[
+        Route('/categories', routes.get_categories, methods=['GET']),
+        Route('/questions', routes.retrieve_all_questions, methods=['GET']),
+        Route('/categories/{id:int}/questions',
+              routes.retrieve_questions_categories, methods=['GET']),
+        Route('/quizzes', routes.trivia_quiz, methods=['POST']),
+        # other paths and methods, including the 405s of the paths above
+        Mount('/', app=WSGIMiddleware(_terminated_input(app)))
+    ], exception_handlers={
+        HTTPException: routes.error,
+        Exception: routes.error
+    }, lifespan=lifespan)
@@ -0,0 +1,121 @@
+import codecs
+import csv
+from flask import json
+from models import Question, read_questions
+from .serialize import encode_question
+
+'''
+bulk import and export of questions
+    imports are parsed and validated row by row while the request body
+    streams in, exports stream rows out of a server-side cursor, so
+    neither holds the whole question bank in memory
+'''
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+class BulkImportError(ValueError):
+    """A row of an import that can not be inserted"""
+
+    def __init__(self, line, reason):
+        super(BulkImportError, self).__init__(
+            'line {}: {}'.format(line, reason))
+        self.line = line
+        self.reason = reason
+
+
+def _lines(stream):
+    return codecs.iterdecode(stream, 'utf-8')
+
+
+def parse_ndjson(stream):
+    '''yields (line number, row) for every JSON object line of stream'''
+    for line_number, line in enumerate(_lines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            raise BulkImportError(line_number, 'invalid JSON')
+        if not isinstance(row, dict):
+            raise BulkImportError(line_number, 'expected a JSON object')
+        yield line_number, row
+
+
+def parse_csv(stream):
+    '''yields (line number, row) for every record of a CSV stream whose
+    first line names the columns'''
+    reader = csv.DictReader(_lines(stream))
+    try:
+        missing = set(FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise BulkImportError(1, 'missing columns {}'.format(
+                ', '.join(sorted(missing))))
+        for row in reader:
+            yield reader.line_num, row
+    except csv.Error as error:
+        # e.g. a field over the size limit. line_num counts the lines of
+        # the records read so far, the bad one is the next
+        raise BulkImportError(reader.line_num + 1,
+                              'invalid CSV: {}'.format(error))
+
+
+def validate(rows, categories):
+    '''yields the insertable dict of each parsed row, raising
+    BulkImportError at the first invalid one'''
+    for line_number, row in rows:
+        question = row.get('question')
+        answer = row.get('answer')
+        if not (question and answer):
+            raise BulkImportError(line_number,
+                                  'question and answer are required')
+        try:
+            category = int(row.get('category'))
+            difficulty = int(row.get('difficulty'))
+        except (TypeError, ValueError):
+            raise BulkImportError(line_number,
+                                  'category and difficulty must be numbers')
+        if category not in categories:
+            raise BulkImportError(line_number,
+                                  'unknown category {}'.format(category))
+        if difficulty < 1:
+            raise BulkImportError(line_number,
+                                  'difficulty must be positive')
+        yield {
+            'question': question,
+            'answer': answer,
+            'category': category,
+            'difficulty': difficulty
+        }
+
+
+def import_questions(stream, content_type, categories):
+    '''inserts the questions of an NDJSON or CSV stream in one
+    transaction, returning (rows read, questions inserted)'''
+    if content_type == 'text/csv':
+        rows = parse_csv(stream)
+    else:
+        rows = parse_ndjson(stream)
+
+    read = [0]
+
+    def counted(rows):
+        for row in rows:
+            read[0] += 1
+            yield row
+
+    inserted = Question.bulk_insert(counted(validate(rows, categories)))
+    return read[0], inserted
+
+
+def export_questions(category=None, batch_size=1000):
+    '''yields every question (of a category) as an NDJSON line, read
+    through a server-side cursor'''
+    query = read_questions().order_by(Question.id)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    rows = query.execution_options(stream_results=True)\
+        .yield_per(batch_size)
+
+    for row in rows:
+        yield encode_question(row) + b'\n'
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from flask import json, request, Response
+from models import Category, on_change
+
+'''
+CategoryRegistry(ttl=None)
+    in-process cache of the {category.id: category.type} map.
+    categories are loaded once and served from memory until a write
+    through the model layer invalidates them, or until ttl seconds have
+    passed (so writes made by other workers are picked up eventually).
+    version is bumped on every invalidation
+'''
+
+
+class CategoryRegistry(object):
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        # (categories, serialized /categories body, etag, loaded at)
+        self._snapshot = None
+
+    def invalidate(self, *args):
+        with self._lock:
+            self._snapshot = None
+            self.version += 1
+
+    def _fresh(self, snapshot):
+        if snapshot is None:
+            return False
+        return self.ttl is None or time.monotonic() - snapshot[3] <= self.ttl
+
+    def _build(self, rows):
+        formatted = {category_id: category_type
+                     for category_id, category_type in rows}
+        body = json.dumps({
+            "success": True,
+            "categories": formatted
+        }).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        return (formatted, body, etag, time.monotonic())
+
+    def _load(self):
+        with self._lock:
+            if self._fresh(self._snapshot):
+                return self._snapshot
+
+            rows = Category.query.with_entities(Category.id, Category.type)\
+                .order_by(Category.id).all()
+            self._snapshot = self._build(rows)
+            return self._snapshot
+
+    def current(self):
+        """The snapshot if it can be served without loading, else None"""
+        snapshot = self._snapshot
+        return snapshot if self._fresh(snapshot) else None
+
+    def load_rows(self, rows):
+        """Snapshot built from (id, type) rows fetched by the caller,
+        for loaders that do not go through the ORM session"""
+        with self._lock:
+            if not self._fresh(self._snapshot):
+                self._snapshot = self._build(rows)
+            return self._snapshot
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if not self._fresh(snapshot):
+            snapshot = self._load()
+        return snapshot
+
+    def categories(self):
+        """Get categories formatted as {1: 'Science', 2: 'Geography'}.
+        The returned dict is shared and must not be modified"""
+        return self.snapshot()[0]
+
+    def response(self):
+        """Prebuilt /categories response, 304 if the client's ETag matches"""
+        categories, body, etag, loaded_at = self.snapshot()
+        if not categories:
+            return None
+
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+
+category_registry = CategoryRegistry()
+on_change(Category)(category_registry.invalidate)
@@ -0,0 +1,157 @@
+import hashlib
+import secrets
+import threading
+from functools import wraps
+from flask import current_app, make_response, request
+from models import Question, Category, on_change
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+'''
+HTTP caching of read endpoints
+    every table has a data version that the model layer bumps on writes:
+    'categories', 'questions' and 'questions:<category>' for the
+    questions of one category ('questions:*' when the category of a
+    changed question is unknown). with a version store configured, a
+    response's ETag is derived from the request path and the versions it
+    depends on, so a matching If-None-Match is answered 304 before the
+    database is touched. without one the ETag is a hash of the body: the
+    view runs, but it is correct whichever worker served it
+'''
+
+
+class MemoryVersions(object):
+    """Versions of this process. The random epoch keeps ETags of two
+    processes, or of a restarted one, from ever matching. Only correct
+    when a single process writes, use RedisVersions otherwise"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.epoch = secrets.token_hex(4)
+
+    def bump(self, keys):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get(self, keys):
+        return [self.epoch] + [self._versions.get(key, 0) for key in keys]
+
+
+class RedisVersions(object):
+    """Versions shared by every worker through Redis counters"""
+
+    def __init__(self, url, prefix='trivia:version:'):
+        if redis is None:
+            raise RuntimeError('the redis package is required for {}'
+                               .format(url))
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        # a new epoch whenever the counters are lost
+        self.client.setnx(prefix + 'epoch', secrets.token_hex(4))
+
+    def bump(self, keys):
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.incr(self.prefix + key)
+        pipe.execute()
+
+    def get(self, keys):
+        return self.client.mget(
+            [self.prefix + 'epoch'] + [self.prefix + key for key in keys])
+
+
+class DataVersions(object):
+
+    def __init__(self):
+        self.backend = None
+
+    def configure(self, config):
+        store = config.get('HTTP_CACHE_VERSION_STORE')
+        if store is None:
+            self.backend = None
+        elif store == 'memory':
+            if not isinstance(self.backend, MemoryVersions):
+                self.backend = MemoryVersions()
+        else:
+            self.backend = RedisVersions(store)
+
+    def bump(self, *keys):
+        if self.backend is not None:
+            self.backend.bump(keys)
+
+    def etag(self, path, keys):
+        """ETag of path from the versions of keys, None without a
+        version store"""
+        if self.backend is None:
+            return None
+        versions = self.backend.get(keys)
+        tag = '{}|{}'.format(path, '|'.join(str(v) for v in versions))
+        return hashlib.sha1(tag.encode('utf-8')).hexdigest()
+
+    def on_question_change(self, action, question):
+        if action in ('insert', 'delete'):
+            self.bump('questions', 'questions:{}'.format(question.category))
+        else:
+            # update or reload, the previous categories are unknown
+            self.bump('questions', 'questions:*')
+
+    def on_category_change(self, action, category):
+        self.bump('categories')
+
+
+data_versions = DataVersions()
+on_change(Question)(data_versions.on_question_change)
+on_change(Category)(data_versions.on_category_change)
+
+
+def _set_cache_control(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = \
+        current_app.config.get('HTTP_CACHE_MAX_AGE', 0)
+    shared_max_age = current_app.config.get('HTTP_CACHE_SHARED_MAX_AGE')
+    if shared_max_age is not None:
+        response.cache_control.s_maxage = shared_max_age
+    return response
+
+
+'''
+cacheable(keys=None)
+    decorator of GET views adding Cache-Control headers and, when keys
+    is given, an ETag from the data versions named by keys(**view_args).
+    requests whose If-None-Match has that ETag get a 304 without the
+    view running. without a version store the ETag is a hash of the
+    view's body. without keys the view sets its own ETag
+'''
+
+
+def cacheable(keys=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if keys is None:
+                return _set_cache_control(make_response(
+                    view(*args, **kwargs)))
+
+            etag = data_versions.etag(request.full_path, keys(**kwargs))
+            if etag is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.add_etag()
+                return _set_cache_control(
+                    response.make_conditional(request))
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            return _set_cache_control(response)
+        return wrapper
+    return decorator
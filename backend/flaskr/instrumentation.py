@@ -0,0 +1,312 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from flask import g, has_app_context, request, Response
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+from models import db, replicas
+
+'''
+per-request instrumentation
+    opt-in with INSTRUMENTATION = True. each request records its wall
+    time, the SQL statements it ran and their time, the rows fetched and
+    the time spent serializing JSON. they are sent back in a
+    Server-Timing header, logged as one JSON line on the
+    'flaskr.requests' logger and aggregated for GET /metrics in the
+    Prometheus text format (per worker process).
+    a request with an X-Profile header matching PROFILE_TOKEN is sampled
+    by a stack profiler, its folded stacks are written to PROFILE_DIR
+'''
+
+logger = logging.getLogger('flaskr.requests')
+
+# upper bounds in seconds of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class RequestMetrics(object):
+    __slots__ = ('start', 'statements', 'sql_seconds', 'rows',
+                 'serialization_seconds', 'errors', '_statement_start')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.serialization_seconds = 0.0
+        self.errors = 0
+        self._statement_start = None
+
+
+def current_metrics():
+    '''metrics of the request being served, None when not instrumented'''
+    if not has_app_context():
+        return None
+    return g.get('request_metrics')
+
+
+class serialization_timer(object):
+    """Adds the time of its block to the current request's serialization
+    time, if the request is instrumented"""
+    __slots__ = ('metrics', 'start')
+
+    def __enter__(self):
+        self.metrics = current_metrics()
+        if self.metrics is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.serialization_seconds += \
+                time.perf_counter() - self.start
+
+
+'''
+report_swallowed()
+    called by views that turn any exception into an error response, logs
+    the exception unless it is an HTTP error the view raised on purpose
+'''
+
+
+def report_swallowed():
+    error = sys.exc_info()[1]
+    if error is None or isinstance(error, HTTPException):
+        return
+    logger.error('%s %s failed', request.method, request.path,
+                 exc_info=True)
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.errors += 1
+
+
+class StackSampler(object):
+    """Sampling profiler of one thread: every interval seconds a
+    background thread records the thread's current stack. Stacks are
+    kept folded (frames joined by ';' and a sample count), the input
+    format of flame graph tools"""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}:{}'.format(
+                    os.path.basename(code.co_filename), code.co_name,
+                    frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.samples.most_common():
+                output.write('{} {}\n'.format(stack, count))
+
+
+class Instrumentation(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (endpoint, method, status) -> requests
+            self.requests = Counter()
+            # endpoint -> [count per bucket..., count, sum of seconds]
+            self.durations = {}
+            self.totals = Counter()
+
+    def init_app(self, app):
+        if not app.config.get('INSTRUMENTATION', False):
+            return
+
+        self.profile_token = app.config.get('PROFILE_TOKEN')
+        self.profile_dir = app.config.get('PROFILE_DIR') or \
+            tempfile.gettempdir()
+
+        engines = [db.get_engine(app)] + replicas.replica_set(app).engines
+        for engine in engines:
+            if getattr(engine, '_request_instrumented', False):
+                continue
+            event.listen(engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+            event.listen(engine, 'after_execute', self._after_execute)
+            engine._request_instrumented = True
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics._statement_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        metrics = current_metrics()
+        if metrics is not None and metrics._statement_start is not None:
+            metrics.statements += 1
+            metrics.sql_seconds += \
+                time.perf_counter() - metrics._statement_start
+            metrics._statement_start = None
+
+    def _after_execute(self, conn, clauseelement, multiparams, params,
+                       result):
+        metrics = current_metrics()
+        if metrics is None or not result.returns_rows:
+            return
+
+        # every fetch method of the result hands its rows to process_rows
+        process_rows = result.process_rows
+
+        def counted(rows):
+            metrics.rows += len(rows)
+            return process_rows(rows)
+        result.process_rows = counted
+
+    def _before_request(self):
+        g.request_metrics = RequestMetrics()
+        token = request.headers.get('X-Profile')
+        if token and self.profile_token and token == self.profile_token:
+            g.stack_sampler = StackSampler(threading.get_ident())
+            g.stack_sampler.start()
+
+    def _after_request(self, response):
+        metrics = g.pop('request_metrics', None)
+        if metrics is None:
+            return response
+        duration = time.perf_counter() - metrics.start
+
+        sampler = g.pop('stack_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+            path = os.path.join(self.profile_dir, 'trivia-{}-{}.folded'
+                                .format(request.endpoint,
+                                        int(time.time() * 1000)))
+            sampler.dump(path)
+            response.headers['X-Profile-Dump'] = path
+
+        response.headers['Server-Timing'] = ', '.join([
+            'app;dur={:.3f}'.format(duration * 1000),
+            'sql;dur={:.3f};desc="{} statements, {} rows"'.format(
+                metrics.sql_seconds * 1000, metrics.statements,
+                metrics.rows),
+            'serialize;dur={:.3f}'.format(
+                metrics.serialization_seconds * 1000)
+        ])
+
+        endpoint = request.endpoint or 'unknown'
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'sql_statements': metrics.statements,
+            'sql_ms': round(metrics.sql_seconds * 1000, 3),
+            'rows': metrics.rows,
+            'serialization_ms': round(
+                metrics.serialization_seconds * 1000, 3),
+            'swallowed_errors': metrics.errors
+        }, sort_keys=True))
+
+        self._observe(endpoint, request.method, response.status_code,
+                      duration, metrics)
+        return response
+
+    def _observe(self, endpoint, method, status, duration, metrics):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            histogram = self.durations.setdefault(
+                endpoint, [0] * (len(DURATION_BUCKETS) + 2))
+            for position, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram[position] += 1
+            histogram[-2] += 1
+            histogram[-1] += duration
+            self.totals['sql_statements', endpoint] += metrics.statements
+            self.totals['sql_seconds', endpoint] += metrics.sql_seconds
+            self.totals['rows', endpoint] += metrics.rows
+            self.totals['serialization_seconds', endpoint] += \
+                metrics.serialization_seconds
+            self.totals['swallowed_errors', endpoint] += metrics.errors
+
+    def render(self):
+        '''the aggregates in the Prometheus text exposition format'''
+        lines = [
+            '# HELP trivia_requests_total Requests served.',
+            '# TYPE trivia_requests_total counter'
+        ]
+        with self._lock:
+            for (endpoint, method, status), count in sorted(
+                    self.requests.items()):
+                lines.append('trivia_requests_total{{endpoint="{}",'
+                             'method="{}",status="{}"}} {}'.format(
+                                 endpoint, method, status, count))
+
+            lines += [
+                '# HELP trivia_request_duration_seconds Request wall time.',
+                '# TYPE trivia_request_duration_seconds histogram'
+            ]
+            for endpoint, histogram in sorted(self.durations.items()):
+                bounds = [str(bound) for bound in DURATION_BUCKETS]
+                for bound, count in zip(bounds + ['+Inf'],
+                                        histogram[:-2] + [histogram[-2]]):
+                    lines.append('trivia_request_duration_seconds_bucket'
+                                 '{{endpoint="{}",le="{}"}} {}'.format(
+                                     endpoint, bound, count))
+                lines.append('trivia_request_duration_seconds_count'
+                             '{{endpoint="{}"}} {}'.format(
+                                 endpoint, histogram[-2]))
+                lines.append('trivia_request_duration_seconds_sum'
+                             '{{endpoint="{}"}} {}'.format(
+                                 endpoint, histogram[-1]))
+
+            for name, help_text in (
+                    ('sql_statements', 'SQL statements executed.'),
+                    ('sql_seconds', 'Time spent in SQL statements.'),
+                    ('rows', 'Rows fetched from the database.'),
+                    ('serialization_seconds', 'Time spent encoding JSON.'),
+                    ('swallowed_errors',
+                     'Exceptions turned into error responses.')):
+                lines += [
+                    '# HELP trivia_{}_total {}'.format(name, help_text),
+                    '# TYPE trivia_{}_total counter'.format(name)
+                ]
+                for (total, endpoint), value in sorted(self.totals.items()):
+                    if total == name:
+                        lines.append('trivia_{}_total{{endpoint="{}"}} {}'
+                                     .format(name, endpoint, value))
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(),
+                        mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,222 @@
+import threading
+from collections import OrderedDict
+from models import Question, on_change
+from .quiz import quiz_index
+from .serialize import json_provider
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+'''
+rendered page cache
+    keeps the serialized "questions" array of each page of
+    /questions ('questions' scope) and /categories/<id>/questions
+    ('category:<id>' scope). totals and categories are spliced in when
+    the response is built, so a write only has to drop the pages whose
+    questions moved: those from the written question's position onwards,
+    in its category and in the global list.
+    opt-in with PAGE_CACHE_STORE: 'memory' is only correct with a single
+    worker process, other workers' writes are not seen
+'''
+
+
+class MemoryPageCache(object):
+    """LRU cache of this process holding at most max_bytes of pages"""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._scopes = {}
+        self._bytes = 0
+
+    def _drop(self, key):
+        body = self._pages.pop(key, None)
+        if body is not None:
+            self._bytes -= len(body)
+            scope, page = key
+            self._scopes[scope].discard(page)
+
+    def get(self, scope, page):
+        with self._lock:
+            body = self._pages.get((scope, page))
+            if body is not None:
+                self._pages.move_to_end((scope, page))
+            return body
+
+    def set(self, scope, page, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._drop((scope, page))
+            self._pages[(scope, page)] = body
+            self._scopes.setdefault(scope, set()).add(page)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._pages)))
+                self.evictions += 1
+
+    def delete_pages(self, scope, from_page):
+        with self._lock:
+            for page in [page for page in self._scopes.get(scope, ())
+                         if page >= from_page]:
+                self._drop((scope, page))
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._scopes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._pages),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions
+        }
+
+
+class RedisPageCache(object):
+    """Pages shared by every worker through Redis (or a compatible
+    store), expiring after ttl seconds. A sorted set per scope indexes
+    the cached page numbers for targeted invalidation"""
+
+    def __init__(self, url, ttl=3600, prefix='trivia:page:'):
+        if redis is None:
+            raise RuntimeError('the redis package is required for {}'
+                               .format(url))
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, scope, page):
+        return '{}{}:{}'.format(self.prefix, scope, page)
+
+    def _index(self, scope):
+        return '{}{}:pages'.format(self.prefix, scope)
+
+    def get(self, scope, page):
+        return self.client.get(self._key(scope, page))
+
+    def set(self, scope, page, body):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(scope, page), body, ex=self.ttl)
+        pipe.zadd(self._index(scope), {str(page): page})
+        pipe.execute()
+
+    def delete_pages(self, scope, from_page):
+        index = self._index(scope)
+        pages = self.client.zrangebyscore(index, from_page, '+inf')
+        if pages:
+            pipe = self.client.pipeline()
+            pipe.delete(*[self._key(scope, int(page)) for page in pages])
+            pipe.zremrangebyscore(index, from_page, '+inf')
+            pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {}
+
+
+class PageCache(object):
+
+    def __init__(self):
+        self.backend = None
+        self.per_page = 10
+        self.hits = 0
+        self.misses = 0
+        # bumped by writes, so a page rendered while one happened
+        # is not cached
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def configure(self, config, per_page):
+        self.per_page = per_page
+        store = config.get('PAGE_CACHE_STORE')
+        max_bytes = config.get('PAGE_CACHE_MAX_BYTES', 16 * 1024 * 1024)
+        if store is None:
+            self.backend = None
+        elif store == 'memory':
+            if not isinstance(self.backend, MemoryPageCache):
+                self.backend = MemoryPageCache(max_bytes)
+            self.backend.max_bytes = max_bytes
+        else:
+            self.backend = RedisPageCache(
+                store, config.get('PAGE_CACHE_TTL', 3600))
+
+    def lookup(self, scope, page):
+        """Serialized page from the cache, or None"""
+        if self.backend is None:
+            return None
+        body = self.backend.get(scope, page)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def store(self, scope, page, body, generation):
+        """Cache a page rendered when self.generation was generation"""
+        if self.backend is not None and generation == self.generation:
+            self.backend.set(scope, page, body)
+
+    def page(self, scope, page, render):
+        """Serialized page from the cache, or render() and cache it"""
+        body = self.lookup(scope, page)
+        if body is None:
+            generation = self.generation
+            body = render()
+            self.store(scope, page, body, generation)
+        return body
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self.generation += 1
+        if self.backend is None:
+            return
+        if action not in ('insert', 'delete'):
+            # updates may move a question between categories
+            return self.backend.clear()
+
+        # number of questions before this one, globally and in its
+        # category, from the in-memory id index; earlier pages did not move
+        position = quiz_index.position(question.id)
+        category_position = quiz_index.position(
+            question.id, question.category)
+
+        self.backend.delete_pages(
+            'questions', position // self.per_page + 1)
+        self.backend.delete_pages(
+            'category:{}'.format(question.category),
+            category_position // self.per_page + 1)
+
+    def stats(self):
+        stats = {'enabled': self.backend is not None, 'hits': self.hits,
+                 'misses': self.misses}
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+page_cache = PageCache()
+on_change(Question)(page_cache.on_question_change)
+
+
+def splice_json(fields, raw_fields):
+    '''bytes of a JSON object holding fields, serialized here, and
+    raw_fields, whose values are already serialized JSON bytes'''
+    members = [(key, json_provider.dumps(value))
+               for key, value in fields.items()]
+    members += list(raw_fields.items())
+    return b'{' + b','.join(
+        json_provider.dumps(key) + b':' + value
+        for key, value in sorted(members)) + b'}'
@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+from sqlalchemy import Integer, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from models import db, Question, QuestionRecord, on_change, \
+    read_questions
+from .instrumentation import serialization_timer
+from .serialize import encode_question
+
+'''
+question identity cache
+    formatted questions by id, filled by batch lookups, and the encoded
+    JSON bytes of questions by id, filled as pages are rendered. entries
+    are dropped by the model layer when a question is updated or deleted,
+    so the questions clients ask for again and again are served without a
+    query and encoded once.
+    like the other in-process caches it is only correct with a single
+    worker process, other workers' writes are not seen
+'''
+
+
+def in_order(ids, found):
+    '''(questions of found in the order of ids, ids not in found)'''
+    return [found[question_id] for question_id in ids
+            if question_id in found], \
+        [question_id for question_id in ids if question_id not in found]
+
+
+class QuestionCache(object):
+    """LRUs of at most max_entries formatted and encoded questions. The
+    cached dicts are shared and must not be modified"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # bumped by writes, so rows read while one happened are not cached
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._questions = OrderedDict()
+        self._encoded = OrderedDict()
+
+    def configure(self, config):
+        self.max_entries = config.get('QUESTION_CACHE_SIZE', 10000)
+
+    def lookup(self, ids):
+        """(cached questions by id, ids to fetch)"""
+        found, wanted = {}, []
+        with self._lock:
+            for question_id in ids:
+                question = self._questions.get(question_id)
+                if question is None:
+                    wanted.append(question_id)
+                else:
+                    self._questions.move_to_end(question_id)
+                    found[question_id] = question
+            self.hits += len(found)
+            self.misses += len(wanted)
+        return found, wanted
+
+    def store(self, rows, generation):
+        """Formatted questions of rows, cached unless a write happened
+        since generation was read"""
+        questions = {row[0]: QuestionRecord(*row).format() for row in rows}
+        with self._lock:
+            if generation == self.generation:
+                self._questions.update(questions)
+                while len(self._questions) > self.max_entries:
+                    self._questions.popitem(last=False)
+        return questions
+
+    def encode_rows(self, rows, generation):
+        """JSON array bytes of question rows, reusing the cached encoding
+        of each question. New encodings are cached unless a write
+        happened since generation was read"""
+        parts = []
+        with serialization_timer(), self._lock:
+            cache = generation == self.generation
+            for row in rows:
+                body = self._encoded.get(row[0])
+                if body is None:
+                    body = encode_question(row)
+                    if cache:
+                        self._encoded[row[0]] = body
+                else:
+                    self._encoded.move_to_end(row[0])
+                parts.append(body)
+            while len(self._encoded) > self.max_entries:
+                self._encoded.popitem(last=False)
+        return b'[' + b','.join(parts) + b']'
+
+    def _fetch(self, ids):
+        '''rows of ids in one statement, = ANY(array) on PostgreSQL'''
+        query = read_questions()
+        if db.engine.dialect.name == 'postgresql':
+            return query.filter(Question.id == any_(
+                bindparam('ids', ids, type_=ARRAY(Integer)))).all()
+        return query.filter(Question.id.in_(ids)).all()
+
+    def get_many(self, ids):
+        """(formatted questions in the order of ids, missing ids), ids
+        seen more than once are returned once"""
+        ids = list(OrderedDict.fromkeys(ids))
+        found, wanted = self.lookup(ids)
+        if wanted:
+            generation = self.generation
+            found.update(self.store(self._fetch(wanted), generation))
+        return in_order(ids, found)
+
+    def on_question_change(self, action, question):
+        with self._lock:
+            self.generation += 1
+            if action == 'reload':
+                self._questions.clear()
+                self._encoded.clear()
+            elif action != 'insert':
+                self._questions.pop(question.id, None)
+                self._encoded.pop(question.id, None)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._questions),
+            'encoded_entries': len(self._encoded),
+            'max_entries': self.max_entries
+        }
+
+
+question_cache = QuestionCache()
+on_change(Question)(question_cache.on_question_change)
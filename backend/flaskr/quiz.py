@@ -0,0 +1,402 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from models import db, Question, on_change, read_questions
+from .snapshot import question_snapshot
+from .store import question_store
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+'''
+QuizIndex()
+    in-memory arrays of question ids per category (None holds every id)
+    and per (category, difficulty) stratum ((None, difficulty) for a
+    difficulty across categories), loaded from the database and kept in
+    sync by the model layer. reloaded after ttl seconds (None keeps it),
+    so questions inserted by other workers become eligible. lets /quizzes
+    pick a random question that is not one of the previous questions, and
+    /quizzes/generate sample a whole quiz, without loading the candidate
+    rows
+'''
+
+
+class QuizIndex(object):
+
+    # random draws tried before falling back to scanning the id array
+    MAX_DRAWS = 8
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ids = None
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+    def _fresh(self):
+        if self._ids is None:
+            return False
+        return self.ttl is None or \
+            time.monotonic() - self._loaded_at <= self.ttl
+
+    def _set(self, ids):
+        self._ids, self._loaded_at = ids, time.monotonic()
+        return ids
+
+    @staticmethod
+    def _keys(category, difficulty):
+        if category is None:
+            return (None, (None, difficulty))
+        return (None, category, (category, difficulty), (None, difficulty))
+
+    def _build(self, rows):
+        ids = {None: array('l')}
+        for question_id, category, difficulty in rows:
+            for key in self._keys(category, difficulty):
+                ids.setdefault(key, array('l')).append(question_id)
+        return ids
+
+    def _load(self):
+        return self._build(
+            db.session.query(Question.id, Question.category,
+                             Question.difficulty)
+            .order_by(Question.id).yield_per(10000))
+
+    def _get_ids(self):
+        with self._lock:
+            if not self._fresh():
+                self._set(self._load())
+            return self._ids
+
+    def current(self):
+        """The index if it can be used without loading, else None"""
+        return self._ids if self._fresh() else None
+
+    def load(self):
+        self._get_ids()
+
+    def load_rows(self, rows):
+        """Index built from (id, category, difficulty) rows in id order
+        fetched by the caller, for loaders that do not go through the ORM
+        session. Returns the index to pass to choose()"""
+        with self._lock:
+            if not self._fresh():
+                self._set(self._build(rows))
+            return self._ids
+
+    def on_question_change(self, action, question):
+        if action == 'reload':
+            return self.invalidate()
+
+        question_id, category = question.id, question.category
+        difficulty = question.difficulty
+        with self._lock:
+            if self._ids is None:
+                return
+            if action == 'update':
+                # the previous category is unknown, rebuild on next use
+                self._ids = None
+            elif action == 'insert':
+                # keep the arrays in id order for position()
+                for key in self._keys(category, difficulty):
+                    ids = self._ids.setdefault(key, array('l'))
+                    ids.insert(bisect_left(ids, question_id), question_id)
+            elif action == 'delete':
+                self._discard(question_id)
+
+    def _discard(self, question_id):
+        for ids in self._ids.values():
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+    def position(self, question_id, category=None):
+        """Number of questions (of category) with a smaller id than
+        question_id"""
+        ids = self._get_ids()
+        with self._lock:
+            return bisect_left(ids.get(category, ()), question_id)
+
+    def choose(self, category=None, exclude=(), ids=None):
+        """Random question id within category (None for all categories)
+        that is not in exclude, or None when every question was served.
+        ids is the index returned by load_rows(), loaded on demand when
+        not given"""
+        exclude = set(exclude)
+        ids = ids or self._get_ids()
+
+        with self._lock:
+            candidates = ids.get(category, ())
+            count = len(candidates)
+
+            # cheap rejection sampling while most ids are still eligible
+            if len(exclude) * 2 < count:
+                for _ in range(self.MAX_DRAWS):
+                    question_id = candidates[random.randrange(count)]
+                    if question_id not in exclude:
+                        return question_id
+
+            remaining = [question_id for question_id in candidates
+                         if question_id not in exclude]
+
+        if not remaining:
+            return None
+        return random.choice(remaining)
+
+    def generate(self, size, categories=None, difficulties=None, seed=None):
+        """(seed, ids) of a quiz of up to size distinct questions drawn by
+        stratified sampling. categories and difficulties map ids (or
+        difficulties) to relative weights; None leaves that dimension
+        unconstrained, following the questions' own distribution. The
+        same seed gives the same quiz as long as the questions do not
+        change. seed is random when not given"""
+        if seed is None:
+            seed = secrets.randbits(32)
+        categories = categories or {None: 1}
+        difficulties = difficulties or {None: 1}
+        rng = random.Random(seed)
+        ids = self._get_ids()
+
+        with self._lock:
+            strata = {}
+            for category, category_weight in sorted(
+                    categories.items(), key=_none_first):
+                for difficulty, difficulty_weight in sorted(
+                        difficulties.items(), key=_none_first):
+                    key = category if difficulty is None \
+                        else (category, difficulty)
+                    strata[key] = (ids.get(key, ()),
+                                   category_weight * difficulty_weight)
+
+            quotas = allocate(size, {key: weight for key, (_, weight)
+                                     in strata.items()},
+                              {key: len(stratum) for key, (stratum, _)
+                               in strata.items()})
+            quiz = []
+            for key, quota in quotas.items():
+                # sample positions, random.sample() only takes sequences
+                # from Python 3.10 on and this avoids copying the array
+                stratum = strata[key][0]
+                quiz.extend(stratum[i] for i in
+                            rng.sample(range(len(stratum)), quota))
+
+        # interleave the strata
+        rng.shuffle(quiz)
+        return seed, quiz
+
+    def next_question(self, category=None, exclude=()):
+        """Random QuestionRecord not in exclude, fetched by primary key"""
+        exclude = set(exclude)
+        while True:
+            question_id = self.choose(category, exclude)
+            if question_id is None:
+                return None
+
+            snapshot = question_snapshot.current()
+            if snapshot is not None:
+                question = snapshot.get(question_id)
+            elif question_store.enabled:
+                question = question_store.get(question_id)
+            else:
+                question = read_questions()\
+                    .filter(Question.id == question_id).first()
+            if question is not None:
+                return question
+
+            # deleted by another worker, forget the stale id
+            with self._lock:
+                if self._ids is not None:
+                    self._discard(question_id)
+            exclude.add(question_id)
+
+
+def _none_first(item):
+    return (item[0] is not None, item[0])
+
+
+'''
+allocate(size, weights, available)
+    quota of each stratum: size split in proportion to weights, with the
+    largest remainders rounded up, never more than the stratum has
+    available. the shortfall of small strata goes to the others
+'''
+
+
+def allocate(size, weights, available):
+    quotas = dict.fromkeys(weights, 0)
+    remaining = size
+    strata = [key for key in weights
+              if weights[key] > 0 and available[key] > 0]
+    while remaining and strata:
+        total = sum(weights[key] for key in strata)
+        shares = {key: remaining * weights[key] / total for key in strata}
+        grants = {key: int(shares[key]) for key in strata}
+        rounded_up = sorted(strata, reverse=True,
+                            key=lambda key: shares[key] - grants[key])
+        for key in rounded_up[:remaining - sum(grants.values())]:
+            grants[key] += 1
+
+        for key in strata:
+            taken = min(grants[key], available[key] - quotas[key])
+            quotas[key] += taken
+            remaining -= taken
+        strata = [key for key in strata if quotas[key] < available[key]]
+    return quotas
+
+
+'''
+parse_weights(value)
+    {key: weight} from a JSON list of ids (equal weights) or an object
+    mapping ids to weights, None when value is empty. raises ValueError
+    or TypeError for anything else
+'''
+
+
+def parse_weights(value):
+    if not value:
+        return None
+    if isinstance(value, list):
+        return {int(key): 1.0 for key in value}
+    weights = {int(key): float(weight) for key, weight in value.items()}
+    if any(weight < 0 for weight in weights.values()):
+        raise ValueError('negative weight')
+    return weights
+
+
+quiz_index = QuizIndex()
+on_change(Question)(quiz_index.on_question_change)
+
+
+'''
+quiz sessions
+    server-side state of a quiz being played: the category and the ids
+    already served. the next question comes from quiz_index, so a session
+    only stores the few ids it has served and clients no longer send
+    previous_questions back and forth
+'''
+
+
+class MemorySessionStore(object):
+    """Sessions held in this process, evicting the least recently used
+    once max_sessions is reached and any idle for more than ttl seconds"""
+
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and \
+                    now - session['touched'] <= self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def create(self, category):
+        session_id = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = {
+                'category': category,
+                'served': array('l'),
+                'touched': now
+            }
+            self._evict(now)
+        return session_id
+
+    def get(self, session_id):
+        """(category, served ids) of a live session, or None"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session['touched'] = now
+            self._sessions.move_to_end(session_id)
+            return session['category'], set(session['served'])
+
+    def add_served(self, session_id, question_id):
+        """Record a served id, False if it was already served"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or question_id in session['served']:
+                return False
+            session['served'].append(question_id)
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+class RedisSessionStore(object):
+    """Sessions kept in Redis so every worker shares them. Each session is
+    a hash holding the category and a set of served ids, both expiring
+    after ttl idle seconds"""
+
+    def __init__(self, url, ttl=3600, prefix='trivia:quiz:'):
+        if redis is None:
+            raise RuntimeError('the redis package is required for {}'
+                               .format(url))
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id):
+        key = self.prefix + session_id
+        return key, key + ':served'
+
+    def create(self, category):
+        session_id = secrets.token_urlsafe(16)
+        key, served_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.hset(key, 'category', category or 0)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return session_id
+
+    def get(self, session_id):
+        key, served_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.hget(key, 'category')
+        pipe.smembers(served_key)
+        pipe.expire(key, self.ttl)
+        pipe.expire(served_key, self.ttl)
+        category, served, _, _ = pipe.execute()
+        if category is None:
+            return None
+        return int(category) or None, set(int(i) for i in served)
+
+    def add_served(self, session_id, question_id):
+        key, served_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.sadd(served_key, question_id)
+        pipe.expire(served_key, self.ttl)
+        added, _ = pipe.execute()
+        return bool(added)
+
+    def delete(self, session_id):
+        return bool(self.client.delete(*self._keys(session_id)))
+
+
+def make_session_store(config):
+    '''builds the store named by QUIZ_SESSION_STORE ('memory' or a
+    redis:// url) from the app config'''
+    store = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', 3600)
+    if store == 'memory':
+        return MemorySessionStore(
+            config.get('QUIZ_SESSION_MAX', 10000), ttl)
+    return RedisSessionStore(store, ttl)
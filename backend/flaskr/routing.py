@@ -0,0 +1,59 @@
+import functools
+import math
+from flask import request
+from models import replicas
+
+'''
+read replica routing of requests
+    GET and HEAD requests, and the views decorated with
+    @reads_from_replica, read from the replicas of
+    SQLALCHEMY_REPLICA_URIS (see models.py). a request that writes gets a
+    cookie keeping the reads of that client on the primary for
+    REPLICA_MAX_LAG seconds, whichever worker serves them, so it reads its
+    own writes
+'''
+
+PRIMARY_COOKIE = 'trivia_primary'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def _wrote_recently():
+    return request.cookies.get(PRIMARY_COOKIE) is not None
+
+
+def reads_from_replica(view):
+    '''routes the reads of a view answering another method than GET'''
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if _wrote_recently():
+            return view(*args, **kwargs)
+        with replicas.reading():
+            return view(*args, **kwargs)
+    wrapper.reads_only = True
+    return wrapper
+
+
+def init_replica_routing(app):
+    replica_set = replicas.replica_set(app)
+    if not replica_set.engines:
+        return
+
+    @app.before_request
+    def route_reads():
+        if request.method in READ_METHODS and not _wrote_recently():
+            replicas.begin_reads()
+
+    @app.after_request
+    def remember_write(response):
+        view = app.view_functions.get(request.endpoint)
+        if request.method not in READ_METHODS + ('OPTIONS',) and \
+                not getattr(view, 'reads_only', False) and \
+                response.status_code < 400:
+            response.set_cookie(PRIMARY_COOKIE, '1',
+                                max_age=math.ceil(replica_set.max_lag),
+                                httponly=True)
+        return response
+
+    @app.teardown_request
+    def end_reads(error=None):
+        replicas.end_reads()
@@ -0,0 +1,261 @@
+import re
+import threading
+from bisect import bisect_left
+from sqlalchemy import func, inspect, literal_column, or_
+from models import db, Question, on_change, read_questions
+
+'''
+question search
+    PostgreSQL databases migrated with the search revision answer searches
+    from the GIN-indexed tsvector columns (question_search, answer_search)
+    together with pg_trgm indexed ILIKE, ranked in SQL.
+    any other database (SQLite test runs, or Postgres before the
+    migration) falls back to an in-memory inverted index.
+    a question matches when every word of the search term is the prefix
+    of a word in it (or in its answer), so partial words keep working;
+    on Postgres a plain substring match (the old ILIKE) also counts
+'''
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# weight of a match in the answer relative to one in the question
+ANSWER_WEIGHT = 0.5
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+class InvertedIndex(object):
+    """Maps each lowercased word of the questions and answers to the ids
+    containing it, kept in sync by the model layer. The question texts
+    are kept too, so suggestions never touch the database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        # field -> token -> set of question ids
+        self._postings = {'question': {}, 'answer': {}}
+        # field -> sorted list of tokens, for prefix lookups
+        self._tokens = {'question': [], 'answer': []}
+        # question id -> (question tokens, answer tokens)
+        self._documents = {}
+        # question id -> question text
+        self._texts = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    def _add(self, question_id, question, answer):
+        fields = (('question', set(tokenize(question))),
+                  ('answer', set(tokenize(answer))))
+        for field, tokens in fields:
+            postings, sorted_tokens = self._postings[field], \
+                self._tokens[field]
+            for token in tokens:
+                if token not in postings:
+                    postings[token] = set()
+                    sorted_tokens.insert(
+                        bisect_left(sorted_tokens, token), token)
+                postings[token].add(question_id)
+        self._documents[question_id] = (fields[0][1], fields[1][1])
+        self._texts[question_id] = question
+
+    def _remove(self, question_id):
+        document = self._documents.pop(question_id, None)
+        if document is None:
+            return
+        del self._texts[question_id]
+        for field, tokens in zip(('question', 'answer'), document):
+            postings, sorted_tokens = self._postings[field], \
+                self._tokens[field]
+            for token in tokens:
+                postings[token].discard(question_id)
+                if not postings[token]:
+                    del postings[token]
+                    del sorted_tokens[bisect_left(sorted_tokens, token)]
+
+    def _load(self):
+        rows = db.session.query(
+            Question.id, Question.question, Question.answer)\
+            .yield_per(10000)
+        for question_id, question, answer in rows:
+            self._add(question_id, question, answer)
+        self._loaded = True
+
+    def load(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+    def on_question_change(self, action, question):
+        if action == 'reload':
+            return self.invalidate()
+
+        question_id = question.id
+        text, answer = question.question, question.answer
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(question_id)
+            if action != 'delete':
+                self._add(question_id, text, answer)
+
+    def _prefix_matches(self, field, prefix):
+        '''ids of documents with a word starting with prefix in field'''
+        sorted_tokens = self._tokens[field]
+        postings = self._postings[field]
+        ids = set()
+        position = bisect_left(sorted_tokens, prefix)
+        while position < len(sorted_tokens) and \
+                sorted_tokens[position].startswith(prefix):
+            ids |= postings[sorted_tokens[position]]
+            position += 1
+        return ids
+
+    def search(self, term, include_answers=False):
+        """Ids matching every word of term, best matches first"""
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            scores = None
+            for token in tokens:
+                token_scores = dict.fromkeys(
+                    self._prefix_matches('question', token), 1.0)
+                if include_answers:
+                    for question_id in self._prefix_matches('answer', token):
+                        token_scores[question_id] = \
+                            token_scores.get(question_id, 0) + ANSWER_WEIGHT
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {question_id: score + token_scores[question_id]
+                              for question_id, score in scores.items()
+                              if question_id in token_scores}
+                if not scores:
+                    return []
+
+        return sorted(scores, key=lambda question_id: (
+            -scores[question_id], question_id))
+
+    def suggest(self, text, limit=10):
+        """Up to limit {id, question} whose question has a word starting
+        with each word of text, closest completions of the last word
+        first"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        complete, prefix = tokens[:-1], tokens[-1]
+
+        suggestions = []
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            sorted_tokens = self._tokens['question']
+            postings = self._postings['question']
+            seen = set()
+            position = bisect_left(sorted_tokens, prefix)
+            while position < len(sorted_tokens) and \
+                    sorted_tokens[position].startswith(prefix):
+                for question_id in postings[sorted_tokens[position]]:
+                    if question_id in seen:
+                        continue
+                    seen.add(question_id)
+                    words = self._documents[question_id][0]
+                    if all(any(word.startswith(token) for word in words)
+                           for token in complete):
+                        suggestions.append({
+                            'id': question_id,
+                            'question': self._texts[question_id]
+                        })
+                        if len(suggestions) == limit:
+                            return suggestions
+                position += 1
+
+        return suggestions
+
+
+inverted_index = InvertedIndex()
+on_change(Question)(inverted_index.on_question_change)
+
+# whether the database has the tsvector columns, checked once per engine
+_full_text_available = {}
+
+
+def full_text_available():
+    engine = db.engine
+    if engine not in _full_text_available:
+        columns = []
+        if engine.dialect.name == 'postgresql':
+            columns = [column['name'] for column in
+                       inspect(engine).get_columns('questions')]
+        _full_text_available[engine] = 'question_search' in columns
+    return _full_text_available[engine]
+
+
+def _full_text_selection(term, include_answers):
+    '''ranked query of questions matching term, using the tsvector
+    columns and the trigram indexes of the search migration'''
+    tokens = tokenize(term)
+    like = '%{}%'.format(term)
+    question_search = literal_column('questions.question_search')
+    answer_search = literal_column('questions.answer_search')
+
+    matches = [Question.question.ilike(like)]
+    rank = func.similarity(Question.question, term)
+    if include_answers:
+        matches.append(Question.answer.ilike(like))
+        rank = rank + ANSWER_WEIGHT * func.similarity(Question.answer, term)
+
+    if tokens:
+        tsquery = func.to_tsquery(
+            'english', ' & '.join(token + ':*' for token in tokens))
+        matches.append(question_search.op('@@')(tsquery))
+        rank = rank + func.ts_rank(question_search, tsquery)
+        if include_answers:
+            matches.append(answer_search.op('@@')(tsquery))
+            rank = rank + \
+                ANSWER_WEIGHT * func.ts_rank(answer_search, tsquery)
+
+    return read_questions().filter(or_(*matches))\
+        .order_by(rank.desc(), Question.id)
+
+
+'''
+search_questions(term, page, per_page, include_answers=False)
+    one page of formatted questions matching term, best matches first,
+    and the total number of matches
+'''
+
+
+def search_questions(term, page, per_page, include_answers=False):
+    if page < 1:
+        return [], 0
+
+    start = (page - 1) * per_page
+
+    if full_text_available():
+        selection = _full_text_selection(term, include_answers)
+        total = selection.order_by(None).count()
+        questions = selection.offset(start).limit(per_page).all()
+        return [question.format() for question in questions], total
+
+    ids = inverted_index.search(term, include_answers)
+    page_ids = ids[start:start + per_page]
+    if not page_ids:
+        return [], len(ids)
+
+    questions = {question.id: question for question in
+                 read_questions().filter(Question.id.in_(page_ids))}
+    return [questions[question_id].format() for question_id in page_ids
+            if question_id in questions], len(ids)
@@ -0,0 +1,86 @@
+import json
+from json.encoder import encode_basestring_ascii
+from flask import Response
+from .instrumentation import serialization_timer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+JSON serialization of responses
+    json_response() encodes payloads with the provider named by
+    JSON_PROVIDER: orjson when it is installed ('auto'), or the standard
+    library encoder, always compact (jsonify pretty-prints in debug mode).
+    questions are encoded straight from (id, question, answer, category,
+    difficulty) row tuples by encode_question(), without building a dict
+'''
+
+
+class StdlibProvider(object):
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonProvider(object):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError('the orjson package is required for '
+                               'JSON_PROVIDER = \'orjson\'')
+
+    def dumps(self, obj):
+        # category maps have int keys
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+class JSONProvider(object):
+
+    def __init__(self):
+        self.backend = StdlibProvider()
+
+    def configure(self, config):
+        name = config.get('JSON_PROVIDER', 'auto')
+        if name == 'auto':
+            name = 'json' if orjson is None else 'orjson'
+        self.backend = OrjsonProvider() if name == 'orjson' \
+            else StdlibProvider()
+
+    def dumps(self, obj):
+        return self.backend.dumps(obj)
+
+
+json_provider = JSONProvider()
+
+
+def json_response(payload, status=200):
+    with serialization_timer():
+        body = json_provider.dumps(payload)
+    return Response(body, status=status, mimetype='application/json')
+
+
+def _number(value):
+    return 'null' if value is None else str(int(value))
+
+
+def _string(value):
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+
+'''
+encode_question(row)
+    bytes of the JSON object of Question.format() for a row tuple, keys
+    sorted as Flask's encoder sorts them
+'''
+
+
+def encode_question(row):
+    question_id, question, answer, category, difficulty = row
+    return ('{{"answer":{},"category":{},"difficulty":{},"id":{},'
+            '"question":{}}}'.format(
+                _string(answer), _number(category), _number(difficulty),
+                _number(question_id), _string(question))).encode('utf-8')
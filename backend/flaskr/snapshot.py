@@ -0,0 +1,397 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+import click
+from flask.cli import AppGroup, with_appcontext
+from flask import current_app
+from models import db, on_change, Category, Question, QuestionRecord
+
+'''
+shared question snapshot
+    a file holding every question and category, built by
+    `flask snapshot build` and mapped read-only by each worker, so the
+    workers of a host share one copy of the questions in the page cache
+    of the OS instead of loading one each. with QUESTION_SNAPSHOT set to
+    its path, the question pages, the quiz questions and the startup
+    loads of the category registry and quiz index read it instead of the
+    database.
+    the file is replaced atomically by each build, with the next
+    generation number, one build at a time under an exclusive lock on
+    the file path.lock. workers check it every SNAPSHOT_CHECK_INTERVAL
+    seconds and map the file when its inode, mtime or size changes, then
+    call the functions registered with on_remap() to drop what they
+    loaded from the previous one. after a write, a worker stops reading the snapshot
+    until a newer generation is mapped; SNAPSHOT_REBUILD_DELAY seconds
+    after a write it rebuilds the file itself, if set
+
+file layout, little-endian
+    header     MAGIC, version, generation, questions, categories, then the
+               (offset, length) in bytes of each section of SECTIONS
+    ids        int32, ascending
+    category, difficulty
+               int32 per question, 0 when missing
+    nulls      uint8 per question, 1: no question text, 2: no answer
+    text       int64 (start, length) in the heap of the question and the
+               answer of each question
+    category directory
+               category_keys int32 ascending, category_rows int64 bounds
+               into by_category, the positions of the questions of each
+               category in id order
+    names      category ids and int64 (start, length) of their type
+    heap       UTF-8 strings, each distinct string stored once
+'''
+
+logger = logging.getLogger('flaskr.snapshot')
+
+MAGIC = b'TRIVSNAP'
+VERSION = 2
+SECTIONS = (
+    ('ids', 'i'), ('category', 'i'), ('difficulty', 'i'), ('nulls', 'B'),
+    ('text', 'q'), ('category_keys', 'i'), ('category_rows', 'q'),
+    ('by_category', 'i'), ('category_ids', 'i'), ('category_names', 'q'),
+    ('heap', 'B')
+)
+_HEADER = struct.Struct('<8sIQQQ' + 'QQ' * len(SECTIONS))
+
+NO_QUESTION, NO_ANSWER = 1, 2
+
+
+class _Heap(object):
+
+    def __init__(self):
+        self.data = bytearray()
+        self._strings = {}
+
+    def add(self, value):
+        if value is None:
+            return 0, 0
+        reference = self._strings.get(value)
+        if reference is None:
+            encoded = value.encode('utf-8')
+            reference = (len(self.data), len(encoded))
+            self.data += encoded
+            self._strings[value] = reference
+        return reference
+
+
+def _generation(path):
+    '''generation of the snapshot at path, 0 if there is none'''
+    try:
+        with open(path, 'rb') as snapshot:
+            header = snapshot.read(_HEADER.size)
+        magic, version, generation = _HEADER.unpack(header)[:3]
+    except (OSError, struct.error):
+        return 0
+    return generation if magic == MAGIC else 0
+
+
+'''
+build_snapshot(path)
+    writes a snapshot of the questions and categories tables to path,
+    replacing any previous one atomically. returns its generation
+'''
+
+
+def build_snapshot(path):
+    # the tables are read under the lock too, so a later generation never
+    # holds older rows than the one before it
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _build_snapshot(path)
+
+
+def _build_snapshot(path):
+    columns = {name: array(code) for name, code in SECTIONS}
+    heap = _Heap()
+    by_category = {}
+
+    rows = db.session.query(
+        Question.id, Question.question, Question.answer, Question.category,
+        Question.difficulty).order_by(Question.id).yield_per(10000)
+    for position, (question_id, question, answer, category, difficulty) \
+            in enumerate(rows):
+        columns['ids'].append(question_id)
+        columns['category'].append(category or 0)
+        columns['difficulty'].append(difficulty or 0)
+        columns['nulls'].append((question is None and NO_QUESTION) |
+                                (answer is None and NO_ANSWER))
+        columns['text'].extend(heap.add(question) + heap.add(answer))
+        by_category.setdefault(category or 0, array('i')).append(position)
+
+    columns['category_rows'].append(0)
+    for category in sorted(by_category):
+        columns['category_keys'].append(category)
+        columns['by_category'].extend(by_category[category])
+        columns['category_rows'].append(len(columns['by_category']))
+
+    for category_id, category_type in db.session.query(
+            Category.id, Category.type).order_by(Category.id):
+        columns['category_ids'].append(category_id)
+        columns['category_names'].extend(heap.add(category_type))
+    columns['heap'] = array('B', heap.data)
+
+    generation = _generation(path) + 1
+    layout, offset = [], _HEADER.size
+    for name, _ in SECTIONS:
+        # every section starts on an 8 byte boundary
+        offset += -offset % 8
+        size = len(columns[name]) * columns[name].itemsize
+        layout.extend((offset, size))
+        offset += size
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(_HEADER.pack(
+            MAGIC, VERSION, generation, len(columns['ids']),
+            len(columns['category_ids']), *layout))
+        for position, (name, _) in enumerate(SECTIONS):
+            snapshot.write(b'\0' * (layout[2 * position] - snapshot.tell()))
+            columns[name].tofile(snapshot)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary, path)
+    return generation
+
+
+class Snapshot(object):
+    """One mapped generation of a snapshot file. Its sections are
+    memoryviews over the mapping, nothing is copied"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot:
+            self._mapping = mmap.mmap(snapshot.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        header = _HEADER.unpack_from(self._mapping)
+        magic, version, self.generation, self.size, _ = header[:5]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} question snapshot'
+                             .format(path, VERSION))
+        view = memoryview(self._mapping)
+        for position, (name, code) in enumerate(SECTIONS):
+            offset, size = header[5 + 2 * position:7 + 2 * position]
+            setattr(self, name, view[offset:offset + size].cast(code))
+
+    def _string(self, start, length):
+        return str(self.heap[start:start + length], 'utf-8')
+
+    def record(self, position):
+        nulls = self.nulls[position]
+        text = self.text[4 * position:4 * position + 4]
+        return QuestionRecord(
+            self.ids[position],
+            None if nulls & NO_QUESTION else self._string(text[0], text[1]),
+            None if nulls & NO_ANSWER else self._string(text[2], text[3]),
+            self.category[position] or None,
+            self.difficulty[position] or None)
+
+    def get(self, question_id):
+        """QuestionRecord of question_id, None if there is none"""
+        position = bisect_left(self.ids, question_id)
+        if position < self.size and self.ids[position] == question_id:
+            return self.record(position)
+        return None
+
+    def _positions(self, category):
+        '''positions of the questions (of category) in id order'''
+        if category is None:
+            return range(self.size)
+        key = bisect_left(self.category_keys, category)
+        if key == len(self.category_keys) or \
+                self.category_keys[key] != category:
+            return range(0)
+        return self.by_category[self.category_rows[key]:
+                                self.category_rows[key + 1]]
+
+    def page(self, category=None, page=1, after_id=None, per_page=10):
+        """QuestionRecords of a page of the questions (of category) in id
+        order, as paginate() selects them"""
+        positions = self._positions(category)
+        if after_id is not None:
+            # positions are in id order, so are the ids they point to
+            start = bisect_right(_Ids(self.ids, positions), after_id)
+        elif page < 1:
+            return []
+        else:
+            start = (page - 1) * per_page
+        return [self.record(position)
+                for position in positions[start:start + per_page]]
+
+    def categories(self):
+        """(id, type) rows of the categories"""
+        names = self.category_names
+        return [(category_id, self._string(names[2 * i], names[2 * i + 1]))
+                for i, category_id in enumerate(self.category_ids)]
+
+    def quiz_rows(self):
+        """(id, category, difficulty) rows in id order"""
+        for position in range(self.size):
+            yield (self.ids[position], self.category[position] or None,
+                   self.difficulty[position] or None)
+
+
+class _Ids(object):
+    '''the ids of positions, as a sequence for bisect'''
+
+    def __init__(self, ids, positions):
+        self.ids = ids
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.ids[self.positions[index]]
+
+
+class QuestionSnapshot(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.path = None
+        self.check_interval = 1
+        self.rebuild_delay = None
+        self._snapshot = None
+        # (inode, mtime, size) of the mapped file
+        self._file = None
+        self._checked_at = None
+        # generation on disk when this worker last wrote, None if it has
+        # not written since a newer one was mapped
+        self._written_at = None
+        self._rebuild = None
+        self._remap_listeners = []
+
+    def init_app(self, app):
+        self.path = app.config.get('QUESTION_SNAPSHOT')
+        self.check_interval = app.config.get('SNAPSHOT_CHECK_INTERVAL', 1)
+        self.rebuild_delay = app.config.get('SNAPSHOT_REBUILD_DELAY')
+        self._snapshot = self._file = self._checked_at = None
+        self._written_at = None
+        self.app = app
+        app.cli.add_command(snapshot_cli)
+
+    def on_remap(self, listener):
+        '''registers listener(snapshot), called when a new file replaces
+        a mapped one'''
+        self._remap_listeners.append(listener)
+        return listener
+
+    def _remap(self):
+        '''maps the file if it changed, returns the new snapshot if it
+        replaced a mapped one'''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._snapshot = self._file = None
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self._file:
+            return None
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError) as error:
+            logger.warning('snapshot %s not mapped: %s', self.path, error)
+            return None
+        # the previous mapping is closed once the requests reading it
+        # drop their references
+        previous = self._snapshot
+        self._snapshot, self._file = snapshot, key
+        logger.info('mapped snapshot generation %s', snapshot.generation)
+        # a file rebuilt after it was removed starts over at generation 1,
+        # a new file is told by its inode, mtime and size
+        return snapshot if previous is not None else None
+
+    def current(self):
+        """The mapped snapshot of the latest generation, None when there
+        is none or this worker wrote since it was built"""
+        if not self.path:
+            return None
+        remapped = None
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or \
+                    now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                remapped = self._remap()
+            snapshot = self._snapshot
+            if snapshot is not None and self._written_at is not None:
+                if snapshot.generation <= self._written_at:
+                    snapshot = None
+                else:
+                    self._written_at = None
+
+        # outside the lock, the listeners may read the new generation
+        if remapped is not None:
+            for listener in self._remap_listeners:
+                try:
+                    listener(remapped)
+                except Exception:
+                    logger.exception('snapshot remap listener failed')
+        return snapshot
+
+    def stats(self):
+        snapshot = self.current()
+        if snapshot is None:
+            return {'path': self.path, 'mapped': False}
+        return {
+            'path': self.path,
+            'mapped': True,
+            'generation': snapshot.generation,
+            'questions': snapshot.size,
+            'bytes': len(snapshot._mapping)
+        }
+
+    def on_change(self, action, instance):
+        if not self.path:
+            return
+        with self._lock:
+            self._written_at = _generation(self.path)
+            if self.rebuild_delay is not None and self._rebuild is None:
+                self._rebuild = threading.Timer(
+                    self.rebuild_delay, self.rebuild)
+                self._rebuild.daemon = True
+                self._rebuild.start()
+
+    def rebuild(self):
+        """Builds a new generation from the database, in the background
+        after writes when SNAPSHOT_REBUILD_DELAY is set"""
+        with self._lock:
+            self._rebuild = None
+        with self.app.app_context():
+            try:
+                generation = build_snapshot(self.path)
+            except Exception:
+                logger.exception('snapshot rebuild failed')
+                return
+            finally:
+                db.session.remove()
+        logger.info('built snapshot generation %s', generation)
+        with self._lock:
+            self._checked_at = None
+
+
+question_snapshot = QuestionSnapshot()
+on_change(Question)(question_snapshot.on_change)
+on_change(Category)(question_snapshot.on_change)
+
+
+snapshot_cli = AppGroup('snapshot', help='Shared question snapshot.')
+
+
+@snapshot_cli.command('build')
+@click.option('--path', help='defaults to QUESTION_SNAPSHOT')
+@with_appcontext
+def build_command(path):
+    '''Write a snapshot of the questions and categories.'''
+    path = path or current_app.config.get('QUESTION_SNAPSHOT')
+    if not path:
+        raise click.UsageError('set QUESTION_SNAPSHOT or pass --path')
+    start = time.perf_counter()
+    generation = build_snapshot(path)
+    click.echo('wrote {} generation {} in {:.1f} ms'.format(
+        path, generation, (time.perf_counter() - start) * 1000))
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+from models import db, question_stats, replicas
+from .categories import category_registry
+from .httpcache import data_versions
+from .pagecache import page_cache
+from .questioncache import question_cache
+from .quiz import quiz_index
+from .search import inverted_index
+from .snapshot import question_snapshot
+from .store import question_store
+
+'''
+startup pipeline
+    warm_up(app) runs the phases that would otherwise slow down the first
+    requests of a worker: configuring the SQLAlchemy mappers, opening the
+    pool's connections, mapping the question snapshot and loading the
+    category registry and the quiz index (from the snapshot when there is
+    one), the question counts, the search index and the question store.
+    each phase is timed, the timings are logged and reported by
+    GET /readyz.
+    create_app() warms up before returning when WARM_UP is set, except in
+    cli commands such as flask db upgrade, else the first request does.
+    with gunicorn --preload the caches are loaded once in the master and
+    shared by the forked workers, which call after_fork() to replace the
+    inherited connections of every engine with their own.
+    when a worker maps a new generation of the snapshot, written after
+    other processes' writes, everything loaded before is dropped and the
+    category registry and quiz index are loaded from the new generation
+'''
+
+logger = logging.getLogger('flaskr.startup')
+
+
+def _open_connections(app):
+    '''checks out as many connections as the pool keeps, at once'''
+    engine = db.get_engine(app)
+    pool = engine.pool
+    count = pool.size() if isinstance(pool, QueuePool) else 1
+    connections = [engine.connect() for _ in range(count)]
+    for connection in connections:
+        connection.scalar('SELECT 1')
+        connection.close()
+
+
+def _engines(app):
+    '''the primary engine, the engines of SQLALCHEMY_BINDS and the
+    read replicas' engines'''
+    engines = [db.get_engine(app)]
+    for bind in app.config.get('SQLALCHEMY_BINDS') or {}:
+        engines.append(db.get_engine(app, bind))
+    return engines + replicas.replica_set(app).engines
+
+
+def _load_categories(app):
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        category_registry.load_rows(snapshot.categories())
+    category_registry.categories()
+
+
+def _load_quiz_index(app):
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        quiz_index.load_rows(snapshot.quiz_rows())
+    quiz_index.load()
+
+
+@question_snapshot.on_remap
+def _reload_from_snapshot(snapshot):
+    for cache in (question_cache, page_cache, data_versions):
+        cache.on_question_change('reload', None)
+    data_versions.on_category_change('reload', None)
+    for cache in (question_stats, inverted_index, question_store,
+                  category_registry, quiz_index):
+        cache.invalidate()
+    category_registry.load_rows(snapshot.categories())
+    quiz_index.load_rows(snapshot.quiz_rows())
+
+
+PHASES = (
+    ('mappers', lambda app: configure_mappers()),
+    ('pool', _open_connections),
+    ('snapshot', lambda app: question_snapshot.current()),
+    ('categories', _load_categories),
+    ('quiz_index', _load_quiz_index),
+    ('question_stats', lambda app: question_stats.load()),
+    ('search_index', lambda app: inverted_index.load()),
+    ('question_store', lambda app: question_store.load())
+)
+
+
+class Startup(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.app = None
+        self.ready = False
+        # phase name -> milliseconds
+        self.phases = OrderedDict()
+
+    def warm_up(self, app):
+        with self._lock:
+            if self.ready and self.app is app:
+                return
+            self.app = app
+            self.ready = False
+            self.phases = OrderedDict()
+            with app.app_context():
+                try:
+                    for name, phase in PHASES:
+                        start = time.perf_counter()
+                        phase(app)
+                        self.phases[name] = round(
+                            (time.perf_counter() - start) * 1000, 3)
+                except Exception as error:
+                    # e.g. the tables are not created yet, the caches
+                    # are then loaded by the requests that need them
+                    logger.warning('warm up stopped in phase %s: %s',
+                                   name, error)
+                    return
+                finally:
+                    db.session.remove()
+            self.ready = True
+        logger.info('warmed up in %.1f ms: %s', self.total_ms(), ', '.join(
+            '{} {} ms'.format(name, ms) for name, ms in self.phases.items()))
+
+    def after_fork(self):
+        """Called in each worker forked from a warmed up process: drops the
+        connections inherited from the parent and opens the worker's own"""
+        if self.app is None:
+            return
+        for engine in _engines(self.app):
+            engine.dispose()
+        start = time.perf_counter()
+        _open_connections(self.app)
+        self.phases['pool'] = round((time.perf_counter() - start) * 1000, 3)
+
+    def total_ms(self):
+        return round(sum(self.phases.values()), 3)
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'phases': dict(self.phases),
+            'total_ms': self.total_ms()
+        }
+
+
+startup = Startup()
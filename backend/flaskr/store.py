@@ -0,0 +1,235 @@
+import logging
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from models import db, on_change, Question, QuestionRecord
+
+'''
+compact question store
+    every question held in memory as columns instead of objects: ids,
+    categories and difficulties in arrays, questions and answers as
+    references into one UTF-8 buffer where each distinct string is stored
+    once (answers repeat a lot). a question costs a few dozen bytes plus
+    its text, against several hundred for a QuestionRecord of Python
+    strings. opt-in with QUESTION_STORE = True, it then serves the pages
+    of GET /questions and GET /categories/<id>/questions and the
+    questions of the quizzes without a query.
+    loaded on first use, kept in sync by the model layer's change hooks.
+    like the other in-process caches it is only correct with a single
+    worker process, other workers' writes are not seen
+'''
+
+logger = logging.getLogger('flaskr.store')
+
+# references of missing strings, and 0 stands for a missing category
+# or difficulty
+NULL = -1
+
+
+class _Columns(object):
+    __slots__ = ('ids', 'categories', 'difficulties', 'questions',
+                 'answers', 'by_category', 'text', 'starts', 'dead')
+
+    def __init__(self):
+        # 32 bit, as the INTEGER columns they come from
+        self.ids = array('i')
+        self.categories = array('i')
+        self.difficulties = array('i')
+        # string references of each question's text and answer
+        self.questions = array('i')
+        self.answers = array('i')
+        # category -> ids of its questions, ascending
+        self.by_category = {}
+        # string i is text[starts[i]:starts[i + 1]]
+        self.text = bytearray()
+        self.starts = array('q', [0])
+        # string references dropped since the strings were last compacted
+        self.dead = 0
+
+    def add_string(self, value, interned=None):
+        if value is None:
+            return NULL
+        if interned is not None:
+            reference = interned.get(value)
+            if reference is not None:
+                return reference
+        self.text += value.encode('utf-8')
+        self.starts.append(len(self.text))
+        reference = len(self.starts) - 2
+        if interned is not None:
+            interned[value] = reference
+        return reference
+
+    def string(self, reference):
+        if reference == NULL:
+            return None
+        return self.text[self.starts[reference]:
+                         self.starts[reference + 1]].decode('utf-8')
+
+    def record(self, position):
+        return QuestionRecord(
+            self.ids[position],
+            self.string(self.questions[position]),
+            self.string(self.answers[position]),
+            self.categories[position] or None,
+            self.difficulties[position] or None)
+
+    def insert(self, position, row, interned=None):
+        question_id, question, answer, category, difficulty = row
+        values = (question_id, category or 0, difficulty or 0,
+                  self.add_string(question, interned),
+                  self.add_string(answer, interned))
+        columns = (self.ids, self.categories, self.difficulties,
+                   self.questions, self.answers)
+        # convert every value before the first column changes, so one
+        # that does not fit leaves the columns in step
+        converted = [array(column.typecode, [value])
+                     for column, value in zip(columns, values)]
+        for column, value in zip(columns, converted):
+            column[position:position] = value
+        # the key record() and delete() read back, 0 stands for no category
+        ids = self.by_category.setdefault(category or None, array('i'))
+        ids.insert(bisect_left(ids, question_id), question_id)
+
+    def delete(self, position):
+        question_id = self.ids[position]
+        ids = self.by_category[self.categories[position] or None]
+        del ids[bisect_left(ids, question_id)]
+        self.dead += (self.questions[position] != NULL) + \
+            (self.answers[position] != NULL)
+        for column in (self.ids, self.categories, self.difficulties,
+                       self.questions, self.answers):
+            del column[position]
+
+    def nbytes(self):
+        return sum(sys.getsizeof(column) for column in (
+            self.ids, self.categories, self.difficulties, self.questions,
+            self.answers, self.text, self.starts)) + \
+            sum(sys.getsizeof(ids) for ids in self.by_category.values())
+
+
+def _build(rows):
+    '''columns of (id, question, answer, category, difficulty) rows in
+    id order, each distinct string stored once'''
+    columns = _Columns()
+    interned = {}
+    for row in rows:
+        columns.insert(len(columns.ids), row, interned)
+    return columns
+
+
+class QuestionStore(object):
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._columns = None
+
+    def configure(self, config):
+        self.enabled = config.get('QUESTION_STORE', False)
+        if not self.enabled:
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._columns = None
+
+    def _load(self):
+        return _build(db.session.query(
+            Question.id, Question.question, Question.answer,
+            Question.category, Question.difficulty)
+            .order_by(Question.id).yield_per(10000))
+
+    def _get_columns(self):
+        with self._lock:
+            if self._columns is None:
+                self._columns = self._load()
+            return self._columns
+
+    def load(self):
+        if self.enabled:
+            self._get_columns()
+
+    def get(self, question_id):
+        """QuestionRecord of question_id, None if there is none"""
+        columns = self._get_columns()
+        with self._lock:
+            position = bisect_left(columns.ids, question_id)
+            if position < len(columns.ids) and \
+                    columns.ids[position] == question_id:
+                return columns.record(position)
+        return None
+
+    def page(self, category=None, page=1, after_id=None, per_page=10):
+        """QuestionRecords of a page of the questions (of category) in id
+        order, as paginate() selects them"""
+        columns = self._get_columns()
+        with self._lock:
+            ids = columns.ids if category is None \
+                else columns.by_category.get(category, ())
+            if after_id is not None:
+                start = bisect_right(ids, after_id)
+            elif page < 1:
+                return []
+            else:
+                start = (page - 1) * per_page
+            return [columns.record(bisect_left(columns.ids, question_id))
+                    for question_id in ids[start:start + per_page]]
+
+    def _compact(self, columns):
+        '''the columns rebuilt without their dead strings'''
+        return _build(columns.record(position)
+                      for position in range(len(columns.ids)))
+
+    def on_question_change(self, action, question):
+        if action == 'reload':
+            self.invalidate()
+            return
+
+        with self._lock:
+            columns = self._columns
+            if columns is None:
+                return
+
+            try:
+                position = bisect_left(columns.ids, question.id)
+                if position < len(columns.ids) and \
+                        columns.ids[position] == question.id:
+                    columns.delete(position)
+                if action != 'delete':
+                    columns.insert(position, (
+                        question.id, question.question, question.answer,
+                        question.category, question.difficulty))
+            except Exception:
+                # the write is committed, reload it on next use rather
+                # than fail the request or skip the other listeners
+                logger.exception('question store update failed, '
+                                 'reloading it')
+                self._columns = None
+                return
+
+            if columns.dead * 2 > len(columns.starts):
+                self._columns = self._compact(columns)
+
+    def stats(self):
+        columns = self._columns
+        if columns is None:
+            return {'enabled': self.enabled, 'loaded': False}
+        with self._lock:
+            questions = len(columns.ids)
+            nbytes = columns.nbytes()
+            strings = len(columns.starts) - 1
+        return {
+            'enabled': self.enabled,
+            'loaded': True,
+            'questions': questions,
+            'strings': strings,
+            'bytes': nbytes,
+            'bytes_per_100k_questions':
+                nbytes * 100000 // questions if questions else 0
+        }
+
+
+question_store = QuestionStore()
+on_change(Question)(question_store.on_question_change)
@@ -0,0 +1,53 @@
+"""full-text search columns and indexes on questions
+
+Revision ID: b5d1e3f7a902
+Revises: 63c7cb86f40d
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d1e3f7a902'
+down_revision = '63c7cb86f40d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tsvector columns and trigram indexes are PostgreSQL only, other
+    # databases are searched through the in-memory inverted index
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        "ALTER TABLE questions ADD COLUMN question_search tsvector "
+        "GENERATED ALWAYS AS "
+        "(to_tsvector('english', coalesce(question, ''))) STORED")
+    op.execute(
+        "ALTER TABLE questions ADD COLUMN answer_search tsvector "
+        "GENERATED ALWAYS AS "
+        "(to_tsvector('english', coalesce(answer, ''))) STORED")
+    op.create_index('ix_questions_question_search', 'questions',
+                    ['question_search'], postgresql_using='gin')
+    op.create_index('ix_questions_answer_search', 'questions',
+                    ['answer_search'], postgresql_using='gin')
+    op.execute('CREATE INDEX ix_questions_question_trgm ON questions '
+               'USING gin (question gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_questions_answer_trgm ON questions '
+               'USING gin (answer gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_questions_answer_trgm', table_name='questions')
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
+    op.drop_index('ix_questions_answer_search', table_name='questions')
+    op.drop_index('ix_questions_question_search', table_name='questions')
+    op.drop_column('questions', 'answer_search')
+    op.drop_column('questions', 'question_search')
@@ -0,0 +1,31 @@
+"""indexes on questions.category and unique question per category
+
+Revision ID: c8e2a4b6d013
+Revises: b5d1e3f7a902
+Create Date: 2026-10-18 11:40:07.218455
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2a4b6d013'
+down_revision = 'b5d1e3f7a902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (category, id) serves category filters, per category counts and
+    # category pages ordered by id, so no separate index on category
+    op.create_index('ix_questions_category_id', 'questions',
+                    ['category', 'id'])
+    op.create_unique_constraint('uq_questions_category_question',
+                                'questions', ['category', 'question'])
+
+
+def downgrade():
+    op.drop_constraint('uq_questions_category_question', 'questions',
+                       type_='unique')
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -1,30 +1,392 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine, ForeignKey
-from sqlalchemy.orm import relationship
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from sqlalchemy import Column, String, Integer, create_engine, ForeignKey, \
+  Index, UniqueConstraint, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, IntegrityError, TimeoutError
+from sqlalchemy.orm import relationship, sessionmaker, Bundle
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 from flask_migrate import Migrate
 
+'''
+read replicas
+    SQLALCHEMY_REPLICA_URIS lists read replicas of the primary database.
+    reads made inside replicas.reading() go to the replicas in turn,
+    skipping those whose last health check failed. writes, reads of a
+    session that has written and reads while no replica is healthy go to
+    the primary. after a write committed by this process, reads stay on
+    the primary for REPLICA_MAX_LAG seconds, so the in-process caches the
+    write invalidated are not refilled from a replica still behind
+'''
+class ReplicaSet(object):
+
+  def __init__(self, app):
+    config = app.config
+    self.health_interval = config.get('REPLICA_HEALTH_INTERVAL', 5)
+    self.max_lag = config.get('REPLICA_MAX_LAG', 5)
+    self.engines = [create_engine(url, **engine_options(config, url))
+                    for url in config.get('SQLALCHEMY_REPLICA_URIS') or []]
+    self._lock = threading.Lock()
+    self._next = 0
+    # engine -> (healthy, checked at)
+    self._checks = {}
+
+  def _healthy(self, engine):
+    now = time.monotonic()
+    healthy, checked_at = self._checks.get(engine, (True, None))
+    if checked_at is not None and now - checked_at < self.health_interval:
+      return healthy
+    try:
+      with engine.connect() as connection:
+        connection.scalar('SELECT 1')
+      healthy = True
+    except DBAPIError:
+      healthy = False
+    self._checks[engine] = (healthy, now)
+    return healthy
+
+  def choose(self):
+    '''next healthy replica engine, None if there is none'''
+    for _ in range(len(self.engines)):
+      with self._lock:
+        engine = self.engines[self._next % len(self.engines)]
+        self._next += 1
+      if self._healthy(engine):
+        return engine
+    return None
+
+  def status(self):
+    now = time.monotonic()
+    status = []
+    for engine in self.engines:
+      healthy, checked_at = self._checks.get(engine, (True, None))
+      status.append({
+        'url': repr(engine.url),
+        'healthy': healthy,
+        'checked_seconds_ago': None if checked_at is None
+          else round(now - checked_at, 3)
+      })
+    return status
+
+class ReplicaRouter(object):
+
+  def __init__(self):
+    self._local = threading.local()
+    self.last_write = None
+
+  def replica_set(self, app):
+    if 'replicas' not in app.extensions:
+      app.extensions['replicas'] = ReplicaSet(app)
+    return app.extensions['replicas']
+
+  @contextmanager
+  def reading(self):
+    '''routes the reads made in the block to the replicas'''
+    previous = getattr(self._local, 'reading', False)
+    self._local.reading = True
+    try:
+      yield
+    finally:
+      self._local.reading = previous
+
+  def begin_reads(self):
+    self._local.reading = True
+
+  def end_reads(self):
+    self._local.reading = False
+
+  def engine_for_read(self, app):
+    '''replica engine for a read, None to read from the primary'''
+    if not getattr(self._local, 'reading', False):
+      return None
+    replica_set = self.replica_set(app)
+    if not replica_set.engines:
+      return None
+    if self.last_write is not None and \
+        time.monotonic() - self.last_write < replica_set.max_lag:
+      return None
+    return replica_set.choose()
+
+  def on_write(self, *args):
+    self.last_write = time.monotonic()
+
+replicas = ReplicaRouter()
+
+class RoutingSession(SignallingSession):
+  '''session sending the reads made inside replicas.reading() to a
+  replica, until it writes'''
+
+  def get_bind(self, mapper=None, clause=None):
+    if self._flushing or isinstance(clause, UpdateBase):
+      self.info['wrote'] = True
+    elif not self.info.get('wrote'):
+      engine = replicas.engine_for_read(self.app)
+      if engine is not None:
+        return engine
+    return super(RoutingSession, self).get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return sessionmaker(class_=RoutingSession, db=self, **options)
+
 #initialising Sqlalchemy db
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
 '''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+MeteredQueuePool
+    QueuePool that also records how many checkouts were made, how long
+    they waited for a connection and how many timed out
 '''
-def setup_db(app):
+class MeteredQueuePool(QueuePool):
+
+  def __init__(self, *args, **kwargs):
+    super(MeteredQueuePool, self).__init__(*args, **kwargs)
+    self._metrics_lock = threading.Lock()
+    self.checkouts = 0
+    self.timeouts = 0
+    self.wait_seconds_total = 0.0
+    self.wait_seconds_max = 0.0
+
+  def _do_get(self):
+    start = time.perf_counter()
+    timed_out = False
+    try:
+      return super(MeteredQueuePool, self)._do_get()
+    except TimeoutError:
+      timed_out = True
+      raise
+    finally:
+      waited = time.perf_counter() - start
+      with self._metrics_lock:
+        self.checkouts += 1
+        self.timeouts += timed_out
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+'''
+engine_options(config, url=None)
+    create_engine() options built from the DB_* settings in config.py,
+    for url or the primary database url.
+    pool sizing, statement_timeout and application_name only apply to
+    PostgreSQL, other databases keep the SQLAlchemy defaults
+'''
+def engine_options(config, url=None):
+  url = url or config['SQLALCHEMY_DATABASE_URI']
+  if not url.startswith('postgres'):
+    return {}
+
+  options = '-c statement_timeout={}'.format(config['DB_STATEMENT_TIMEOUT'])
+  return {
+    'poolclass': MeteredQueuePool,
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_MAX_OVERFLOW'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    'connect_args': {
+      'application_name': config['DB_APPLICATION_NAME'],
+      'options': options
+    }
+  }
+
+'''
+pool_status(engine=None)
+    current state of the connection pool, plus the checkout metrics of
+    a MeteredQueuePool since the pool was created
+'''
+def pool_status(engine=None):
+  pool = (engine or db.engine).pool
+  status = {'class': type(pool).__name__}
+  if isinstance(pool, QueuePool):
+    status.update({
+      'size': pool.size(),
+      'checked_in': pool.checkedin(),
+      'checked_out': pool.checkedout(),
+      'overflow': pool.overflow()
+    })
+  if isinstance(pool, MeteredQueuePool):
+    with pool._metrics_lock:
+      status.update({
+        'checkouts': pool.checkouts,
+        'timeouts': pool.timeouts,
+        'wait_seconds_total': pool.wait_seconds_total,
+        'wait_seconds_max': pool.wait_seconds_max
+      })
+  return status
+
+'''
+setup_db(app, database_uri=None, replica_uris=None)
+    binds a flask application and a SQLAlchemy service, to the database
+    and read replicas of config.py unless others are given
+'''
+def setup_db(app, database_uri=None, replica_uris=None):
     app.config.from_object('config')
+    if database_uri is not None:
+      app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    if replica_uris is not None:
+      app.config['SQLALCHEMY_REPLICA_URIS'] = list(replica_uris)
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+      app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.app = app
     db.init_app(app)
     migrate.init_app(app, db)
     # db.create_all()
+
+'''
+change listeners
+    functions registered with @on_change(Model) are called as
+    listener(action, instance) once a write to that model has been
+    committed, action being one of 'insert', 'update' or 'delete'.
+    after bulk writes they are called as listener('reload', None)
+    and should drop whatever they derived from the table
+'''
+_change_listeners = {}
+
+def on_change(model):
+  def register(listener):
+    _change_listeners.setdefault(model, []).append(listener)
+    return listener
+  return register
+
+def _notify_change(action, instance):
+  for listener in _change_listeners.get(type(instance), []):
+    listener(action, instance)
+
+def _notify_reload(model):
+  for listener in _change_listeners.get(model, []):
+    listener('reload', None)
+
+'''
+QuestionStats()
+    in-memory mirror of the number of questions per (category,
+    difficulty), loaded with one GROUP BY query and maintained by
+    inserts and deletes, so totals never need a query after a write.
+    updates and bulk inserts invalidate it, it reloads on next use, and
+    after ttl seconds (None keeps it) so other workers' writes are counted
+'''
+class QuestionStats(object):
+
+  def __init__(self, ttl=None):
+    self.ttl = ttl
+    self._lock = threading.Lock()
+    self._counts = None
+    self._loaded_at = None
+
+  def invalidate(self):
+    with self._lock:
+      self._counts = None
+
+  def _fresh(self):
+    if self._counts is None:
+      return False
+    return self.ttl is None or time.monotonic() - self._loaded_at <= self.ttl
+
+  def _set(self, counts):
+    self._counts, self._loaded_at = counts, time.monotonic()
+    return counts
+
+  def _build(self, rows):
+    return {(category, difficulty): count
+            for category, difficulty, count in rows if count}
+
+  def _get_counts(self):
+    with self._lock:
+      if not self._fresh():
+        self._set(self._build(
+          db.session.query(Question.category, Question.difficulty,
+                           func.count(Question.id))
+          .group_by(Question.category, Question.difficulty)))
+      return self._counts
+
+  def load(self):
+    self._get_counts()
+
+  def current(self):
+    '''the counts if they can be used without loading, else None'''
+    return self._counts if self._fresh() else None
+
+  def load_rows(self, rows):
+    '''counts built from (category, difficulty, count) rows fetched by
+    the caller, for loaders that do not go through the ORM session.
+    returns the counts to pass to count() and summary()'''
+    with self._lock:
+      if not self._fresh():
+        self._set(self._build(rows))
+      return self._counts
+
+  def adjust(self, category, difficulty, delta):
+    with self._lock:
+      if self._counts is None:
+        return
+      key = (category, difficulty)
+      count = self._counts.get(key, 0) + delta
+      if count > 0:
+        self._counts[key] = count
+      else:
+        self._counts.pop(key, None)
+
+  def count(self, category=None, difficulty=None, counts=None):
+    '''number of questions, optionally of a category and/or difficulty'''
+    counts = self._get_counts() if counts is None else counts
+    with self._lock:
+      return sum(count for (c, d), count in counts.items()
+                 if category in (None, c) and difficulty in (None, d))
+
+  def summary(self, counts=None):
+    '''totals by category, by difficulty and by both'''
+    counts = self._get_counts() if counts is None else counts
+    by_category, by_difficulty, by_both = {}, {}, {}
+    with self._lock:
+      for (category, difficulty), count in sorted(
+          counts.items(), key=lambda item: (item[0][0] or 0, item[0][1] or 0)):
+        by_category[category] = by_category.get(category, 0) + count
+        by_difficulty[difficulty] = by_difficulty.get(difficulty, 0) + count
+        by_both.setdefault(category, {})[difficulty] = count
+    return {
+      'total_questions': sum(by_category.values()),
+      'categories': by_category,
+      'difficulties': by_difficulty,
+      'categories_by_difficulty': by_both
+    }
+
+question_stats = QuestionStats()
+
+'''
+_insert_ignoring_duplicates(values)
+    INSERT of one dict or a list of dicts into questions that skips rows
+    violating the unique (category, question) constraint
+'''
+def _insert_ignoring_duplicates(values):
+  table = Question.__table__
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    return postgresql.insert(table).values(values)\
+      .on_conflict_do_nothing(index_elements=['category', 'question'])
+  if dialect == 'sqlite':
+    return table.insert().values(values).prefix_with('OR IGNORE')
+  return table.insert().values(values)
+
 '''
 Question
 
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # category listings and counts, ordered by id
+    Index('ix_questions_category_id', 'category', 'id'),
+    # no duplicate question within a category
+    UniqueConstraint('category', 'question',
+                     name='uq_questions_category_question'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
@@ -41,13 +403,147 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    question_stats.adjust(self.category, self.difficulty, 1)
+    _notify_change('insert', self)
+  
+  '''
+  insert_unique()
+      inserts the question unless its category already has the same
+      question, in a single INSERT ... ON CONFLICT DO NOTHING statement
+      instead of a SELECT followed by an INSERT.
+      returns False, inserting nothing, for a duplicate
+  '''
+  def insert_unique(self):
+    statement = _insert_ignoring_duplicates({
+      'question': self.question,
+      'answer': self.answer,
+      'category': self.category,
+      'difficulty': self.difficulty
+    })
+
+    try:
+      result = db.session.execute(statement)
+    except IntegrityError:
+      db.session.rollback()
+      return False
+    if not result.rowcount:
+      db.session.rollback()
+      return False
+
+    self.id = result.inserted_primary_key[0]
+    db.session.commit()
+    question_stats.adjust(self.category, self.difficulty, 1)
+    _notify_change('insert', self)
+    return True
+  
+  '''
+  bulk_insert(rows, batch_size=500)
+      inserts an iterable of {question, answer, category, difficulty}
+      dicts with one multi-row INSERT per batch_size rows, all in one
+      transaction, skipping questions already in their category.
+      rows is consumed lazily, so a generator parsing a stream keeps
+      memory constant; any error it raises rolls everything back.
+      returns the number of questions inserted
+  '''
+  @classmethod
+  def bulk_insert(cls, rows, batch_size=500):
+    inserted = 0
+    batch = []
+    try:
+      for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+          inserted += db.session.execute(
+            _insert_ignoring_duplicates(batch)).rowcount
+          batch = []
+      if batch:
+        inserted += db.session.execute(
+          _insert_ignoring_duplicates(batch)).rowcount
+      db.session.commit()
+    except:
+      db.session.rollback()
+      raise
+
+    question_stats.invalidate()
+    _notify_reload(cls)
+    return inserted
   
   def update(self):
     db.session.commit()
+    # the previous category and difficulty are unknown, recount
+    question_stats.invalidate()
+    _notify_change('update', self)
 
   def delete(self):
+    category, difficulty = self.category, self.difficulty
     db.session.delete(self)
     db.session.commit()
+    question_stats.adjust(category, difficulty, -1)
+    _notify_change('delete', self)
+
+  '''
+  delete_by_id(question_id)
+      deletes a question without loading it first: a single
+      DELETE ... RETURNING on PostgreSQL, a lookup and a delete elsewhere.
+      returns the deleted question's category, None if it did not exist
+  '''
+  @classmethod
+  def delete_by_id(cls, question_id):
+    if db.engine.dialect.name != 'postgresql':
+      question = cls.query.get(question_id)
+      if question is None:
+        return None
+      question.delete()
+      return question.category
+
+    table = cls.__table__
+    row = db.session.execute(
+      table.delete().where(table.c.id == question_id)
+      .returning(table.c.category, table.c.difficulty)).first()
+    if row is None:
+      db.session.rollback()
+      return None
+    db.session.commit()
+
+    # listeners only get the id, category and difficulty of the
+    # deleted question
+    deleted = cls(question=None, answer=None, category=row[0],
+                  difficulty=row[1])
+    deleted.id = question_id
+    question_stats.adjust(deleted.category, deleted.difficulty, -1)
+    _notify_change('delete', deleted)
+    return deleted.category
+
+  '''
+  count(category=None, difficulty=None)
+      total number of questions, optionally of a category and/or a
+      difficulty, answered from question_stats instead of loading rows
+  '''
+  @classmethod
+  def count(cls, category=None, difficulty=None):
+    return question_stats.count(category, difficulty)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'question': self.question,
+      'answer': self.answer,
+      'category': self.category,
+      'difficulty': self.difficulty
+    }
+
+'''
+read-only question queries
+    QuestionRecord is an immutable (id, question, answer, category,
+    difficulty) tuple with the format() of Question. read_questions() is
+    a query selecting just those columns, built straight into records
+    without the identity map, change tracking and attribute
+    instrumentation of Question instances. read paths use it, Question
+    instances are kept for writes
+'''
+class QuestionRecord(namedtuple('QuestionRecord', [
+    'id', 'question', 'answer', 'category', 'difficulty'])):
+  __slots__ = ()
 
   def format(self):
     return {
@@ -58,6 +554,24 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+class _QuestionRecords(Bundle):
+  def create_row_processor(self, query, procs, labels):
+    def process(row):
+      return QuestionRecord(*[proc(row) for proc in procs])
+    return process
+
+_question_records = _QuestionRecords(
+  'question_record', Question.id, Question.question, Question.answer,
+  Question.category, Question.difficulty, single_entity=True)
+
+'''
+read_questions()
+    query of QuestionRecord records, to be filtered and ordered like
+    Question.query
+'''
+def read_questions():
+  return db.session.query(_question_records)
+
 '''
 Category
 
@@ -67,13 +581,33 @@ class Category(db.Model):
 
   id = Column(Integer, primary_key=True)
   type = Column(String, unique=True)
-  question = relationship('Question', backref='categories', lazy=False)
+  # loaded lazily; queries that need the questions opt in per query with
+  # .options(selectinload(Category.question)) instead of every category
+  # lookup joining in the whole questions table
+  question = relationship('Question', backref='categories')
 
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    _notify_change('insert', self)
+
+  def update(self):
+    db.session.commit()
+    _notify_change('update', self)
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    _notify_change('delete', self)
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+# reads stay on the primary for a while after a write
+on_change(Question)(replicas.on_write)
+on_change(Category)(replicas.on_write)
@@ -1,10 +1,138 @@
 import os
+import re
+import sqlite3
+import tempfile
 import unittest
 import json
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, exc
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.httpcache import data_versions
+from flaskr.instrumentation import instrumentation
+from flaskr.pagecache import page_cache
+from flaskr.quiz import quiz_index, QuizIndex
+from flaskr.startup import startup, PHASES
+from flaskr.store import question_store
+from flaskr.snapshot import question_snapshot
+from flaskr.serialize import encode_question
+from models import db, setup_db, read_questions, replicas, \
+    question_stats, MeteredQueuePool, Question, Category
+
+# TRIVIA_TEST_MODE=asgi runs the suite against the ASGI entry point
+TEST_MODE = os.environ.get('TRIVIA_TEST_MODE', 'wsgi')
+if TEST_MODE == 'asgi':
+    import asyncio
+    from starlette.testclient import TestClient
+    from flaskr.asgi import create_asgi_app, AsyncDatabase
+
+
+class AsgiTestResponse(object):
+    """The attributes of Flask test responses the tests use"""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.data = response.content
+        self.headers = response.headers
+        self.mimetype = response.headers.get('content-type', '')\
+            .split(';')[0].strip()
+
+
+class AsgiTestClient(object):
+    """Flask test client methods over Starlette's TestClient"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, path, method='GET', json=None, data=None,
+             content_type=None, headers=None):
+        headers = dict(headers or {})
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        kwargs = {}
+        if json is not None:
+            kwargs['json'] = json
+        if data is not None:
+            kwargs['content'] = data
+        return AsgiTestResponse(self.client.request(
+            method, path, headers=headers, **kwargs))
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, 'PATCH', **kwargs)
+
+
+class QueryCounter(object):
+    """Counts SQL statements and ORM rows loaded while it is active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.questions_loaded = 0
+        self.categories_loaded = 0
+        self.executed = []
+
+    def _count_statement(self, conn, cursor, statement, parameters,
+                         context, executemany):
+        self.statements += 1
+        self.executed.append((statement, parameters))
+
+    def _count_question(self, target, context):
+        self.questions_loaded += 1
+
+    def _count_category(self, target, context):
+        self.categories_loaded += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+        event.listen(Question, 'load', self._count_question)
+        event.listen(Category, 'load', self._count_category)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+        event.remove(Question, 'load', self._count_question)
+        event.remove(Category, 'load', self._count_category)
+
+
+def full_scans_of_questions(engine, executed):
+    """Filtered SELECTs on questions whose plan scans the whole table"""
+    postgres = engine.dialect.name == 'postgresql'
+    explain = 'EXPLAIN ' if postgres else 'EXPLAIN QUERY PLAN '
+    full_scan = re.compile(r'Seq Scan on questions' if postgres
+                           else r'SCAN (TABLE )?questions(?! USING)')
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if postgres:
+            # tiny test tables are always cheaper to scan sequentially
+            cursor.execute('SET enable_seqscan = off')
+        scans = []
+        for statement, parameters in executed:
+            filtered_select = r'\s*SELECT\b.*\bFROM questions\b.*\bWHERE\b'
+            if not re.match(filtered_select, statement, re.S):
+                continue
+            cursor.execute(explain + statement, parameters)
+            plan = '\n'.join(' '.join(str(c) for c in row)
+                             for row in cursor.fetchall())
+            if full_scan.search(plan):
+                scans.append((statement, plan))
+        return scans
+    finally:
+        connection.rollback()
+        connection.close()
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -24,6 +152,14 @@ class TriviaTestCase(unittest.TestCase):
             # create all tables
             self.db.create_all()
 
+        if TEST_MODE == 'asgi':
+            # serve the same app through the ASGI entry point
+            test_client = TestClient(create_asgi_app(self.app))
+            test_client.__enter__()
+            self.addCleanup(test_client.__exit__, None, None, None)
+            client = AsgiTestClient(test_client)
+            self.client = lambda: client
+
         self.new_question = {
             "question": "FAC champion",
             "answer": "Arsenal",
@@ -100,6 +236,29 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
         self.assertTrue(len(data['categories']))
 
+    def test_304_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_categories_invalidated_on_write(self):
+        before = json.loads(self.client().get('/categories').data)
+
+        with self.app.app_context():
+            category = Category(type='Registry test')
+            category.insert()
+            after_insert = json.loads(self.client().get('/categories').data)
+            category.delete()
+        after_delete = json.loads(self.client().get('/categories').data)
+
+        self.assertIn('Registry test', after_insert['categories'].values())
+        self.assertEqual(after_delete['categories'], before['categories'])
+
     def test_404_resource_not_found_on_categories(self):
         res = self.client().get('/categories/300')
         data = json.loads(res.data)
@@ -127,6 +286,173 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(len(data['categories']))
 
+    def test_keyset_paginated_questions(self):
+        first_page = json.loads(self.client().get('/questions').data)
+        last_id = first_page['questions'][-1]['id']
+
+        res = self.client().get('/questions?after_id={}'.format(last_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'],
+                         first_page['total_questions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertTrue(all(q['id'] > last_id for q in data['questions']))
+
+    def test_questions_by_ids_in_requested_order(self):
+        first_page = json.loads(self.client().get('/questions').data)
+        ids = [question['id'] for question in first_page['questions']]
+        wanted = [ids[2], ids[0], 99999, ids[1]]
+
+        res = self.client().get('/questions?ids={}'.format(
+            ','.join(str(question_id) for question_id in wanted)))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [ids[2], ids[0], ids[1]])
+        self.assertEqual(data['questions'][1], first_page['questions'][0])
+        self.assertEqual(data['missing'], [99999])
+        self.assertEqual(data['total_questions'], 3)
+
+    def test_questions_batch_lookup(self):
+        question = dict(self.new_question, question='Batch fetched one')
+        created = json.loads(self.client().post(
+            '/questions', json=question).data)['created']
+
+        res = self.client().post('/questions/batch',
+                                 json={"ids": [created]})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'][0]['question'],
+                         'Batch fetched one')
+
+        # deleting drops the cached question
+        self.client().delete('/questions/{}'.format(created))
+        data = json.loads(self.client().post(
+            '/questions/batch', json={"ids": [created]}).data)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['missing'], [created])
+
+    def test_400_questions_by_invalid_ids(self):
+        res = self.client().get('/questions?ids=1,two')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post('/questions/batch', json={"ids": []})
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post('/questions/batch',
+                                 json={"ids": list(range(1, 1000))})
+        self.assertEqual(res.status_code, 400)
+
+    def test_encoded_questions_match_format(self):
+        row = (7, 'Who said "caf\u00e9"?\n', 'Me \\ you', 3, None)
+        self.assertEqual(json.loads(encode_question(row)), {
+            'id': 7,
+            'question': 'Who said "caf\u00e9"?\n',
+            'answer': 'Me \\ you',
+            'category': 3,
+            'difficulty': None
+        })
+
+        with self.app.app_context():
+            questions = Question.query.order_by(Question.id).limit(10).all()
+        page = json.loads(self.client().get('/questions').data)
+        self.assertEqual(page['questions'],
+                         [question.format() for question in questions])
+
+    def test_404_beyond_last_page_of_questions(self):
+        res = self.client().get('/questions?page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_304_questions_not_modified_until_a_write(self):
+        data_versions.configure({'HTTP_CACHE_VERSION_STORE': 'memory'})
+        res = self.client().get('/questions?page=1')
+        etag = res.headers['ETag']
+        self.assertIn('public', res.headers['Cache-Control'])
+
+        with self.count_queries() as counter:
+            res = self.client().get('/questions?page=1',
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(counter.statements, 0)
+
+        res = self.client().get('/questions?page=2',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+        question = dict(self.new_question, question='HTTP cache question')
+        created = json.loads(self.client().post(
+            '/questions', json=question).data)['created']
+        res = self.client().get('/questions?page=1',
+                                headers={'If-None-Match': etag})
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_304_category_questions_keyed_per_category(self):
+        data_versions.configure({'HTTP_CACHE_VERSION_STORE': 'memory'})
+        res = self.client().get('/categories/1/questions')
+        etag = res.headers['ETag']
+
+        question = dict(self.new_question, question='HTTP cache question')
+        created = json.loads(self.client().post(
+            '/questions', json=question).data)['created']
+        res = self.client().get('/categories/1/questions',
+                                headers={'If-None-Match': etag})
+        self.client().delete('/questions/{}'.format(created))
+
+        # the new question is in category 2
+        self.assertEqual(res.status_code, 304)
+
+    def test_304_from_the_body_without_a_version_store(self):
+        res = self.client().get('/categories/1/questions')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories/1/questions',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        question = dict(self.new_question, question='HTTP cache question',
+                        category=1)
+        created = json.loads(self.client().post(
+            '/questions', json=question).data)['created']
+        res = self.client().get('/categories/1/questions',
+                                headers={'If-None-Match': etag})
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_page_cache_keeps_pages_before_a_write(self):
+        page_cache.configure({'PAGE_CACHE_STORE': 'memory'}, 10)
+        self.client().get('/questions?page=1')
+        self.client().get('/categories/1/questions?page=1')
+
+        question = dict(self.new_question, question='Page cache question')
+        res = self.client().post('/questions', json=question)
+        created = json.loads(res.data)['created']
+        total = json.loads(res.data)['total_questions']
+
+        hits = json.loads(self.client().get('/cache').data)[
+            'page_cache']['hits']
+        first_page = json.loads(self.client().get('/questions?page=1').data)
+        self.client().get('/categories/1/questions?page=1')
+        last_page = json.loads(self.client().get(
+            '/categories/2/questions?page={}'.format((total - 1) // 10 + 1)
+            ).data)
+        stats = json.loads(self.client().get('/cache').data)['page_cache']
+        self.client().delete('/questions/{}'.format(created))
+
+        # page 1 of both listings is still cached, the new question is
+        # on the refreshed last page of its category
+        self.assertEqual(stats['hits'], hits + 2)
+        self.assertNotIn(created, [q['id'] for q in first_page['questions']])
+        self.assertIn(created, [q['id'] for q in last_page['questions']])
+
     def test_405_method_not_allowed_on_questions_route(self):
         res = self.client().get('/questions/3')
         data = json.loads(res.data)
@@ -163,6 +489,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(len(data['questions']))
 
+    def test_minimal_create_and_delete_responses(self):
+        question = dict(self.new_question, question='Minimal question')
+        res = self.client().post('/questions?return=minimal', json=question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.headers['Preference-Applied'], 'return=minimal')
+        self.assertTrue(data['created'])
+        self.assertTrue(data['total_questions'])
+        self.assertNotIn('questions', data)
+
+        with self.count_queries() as counter:
+            res = self.client().delete(
+                '/questions/{}'.format(data['created']),
+                headers={'Prefer': 'return=minimal'})
+        deleted = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(deleted['deleted'], data['created'])
+        self.assertEqual(deleted['total_questions'],
+                         data['total_questions'] - 1)
+        self.assertNotIn('questions', deleted)
+        self.assertLessEqual(counter.statements, 2)
+
     def test_400_no_question_create_new_questions(self):
         res = self.client().post('/questions', json=self.data1_missing_question)
         data = json.loads(res.data)
@@ -211,6 +561,57 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(type(data['questions']), list)
 
+    def test_search_finds_question_by_partial_words(self):
+        question = json.loads(
+            self.client().get('/questions').data)['questions'][0]
+        search_term = max(question['question'].split(), key=len)[:3]
+
+        res = self.client().post('/questions',
+                                 json={"searchTerm": search_term})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['total_questions'] >= 1)
+        self.assertTrue(len(data['questions']) <= 10)
+
+    def test_search_answers(self):
+        question = json.loads(
+            self.client().get('/questions').data)['questions'][0]
+
+        res = self.client().post('/questions', json={
+            "searchTerm": question['answer'],
+            "searchAnswers": True
+            })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(question['id'], [q['id'] for q in data['questions']])
+
+    # /questions/suggest
+    def test_suggest_questions(self):
+        question = json.loads(
+            self.client().get('/questions').data)['questions'][0]
+        prefix = question['question'].split()[0][:2].lower()
+
+        res = self.client().get('/questions/suggest?q={}&limit=5'
+                                .format(prefix))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(1 <= len(data['suggestions']) <= 5)
+        for suggestion in data['suggestions']:
+            words = suggestion['question'].lower().split()
+            self.assertTrue(any(w.startswith(prefix) for w in words))
+
+    def test_400_suggest_without_query(self):
+        res = self.client().get('/questions/suggest')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_405_wrong_methods_on_questions(self):
         res = self.client().patch('/questions/1')
         data = json.loads(res.data)
@@ -219,6 +620,88 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'method not allowed')
 
+    # /questions/bulk and /questions/export
+    def test_bulk_import_ndjson_and_export(self):
+        rows = [
+            {"question": "Bulk question {}".format(i), "answer": "Bulk",
+             "category": 1, "difficulty": 2}
+            for i in range(3)
+            ]
+        body = '\n'.join(json.dumps(row) for row in rows + rows[:1])
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual(data['skipped'], 1)
+
+        res = self.client().get('/questions/export?category=1')
+        exported = [json.loads(line) for line in
+                    res.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        bulk = [q for q in exported if q['answer'] == 'Bulk']
+        self.assertEqual(len(bulk), 3)
+
+        for question in bulk:
+            self.client().delete('/questions/{}'.format(question['id']))
+
+    def test_bulk_import_csv(self):
+        body = 'question,answer,category,difficulty\n' \
+            'Bulk CSV question,"Yes, really",2,1\n'
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['inserted'], 1)
+
+        search = json.loads(self.client().post(
+            '/questions', json={"searchTerm": "Bulk CSV question"}).data)
+        self.client().delete(
+            '/questions/{}'.format(search['questions'][0]['id']))
+
+    def test_400_bulk_import_malformed_csv(self):
+        body = 'question,answer,category,difficulty\n' \
+            'Long question,"{}",2,1\n'.format('x' * 200000)
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['line'], 2)
+        self.assertIn('invalid CSV', data['reason'])
+
+    def test_400_bulk_import_rolls_back_invalid_rows(self):
+        total = json.loads(self.client().get('/questions').data)[
+            'total_questions']
+        body = 'question,answer,category,difficulty\n' \
+            'Rolled back question,Yes,2,1\n' \
+            'Invalid question,Yes,not a category,1\n'
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['line'], 3)
+        self.assertEqual(json.loads(self.client().get('/questions').data)[
+            'total_questions'], total)
+
+    def test_415_bulk_import_unsupported_format(self):
+        res = self.client().post('/questions/bulk', json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(data['message'], 'unsupported media type')
+
     # /categories/<id>/questions
     def test_retrieve_all_questions_within_a_category(self):
         res = self.client().get('/categories/1/questions')
@@ -267,6 +750,194 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(type(data['question']), dict)
         self.assertTrue(len(data['previous_questions']))
 
+    def test_quiz_category_id_sent_as_a_string(self):
+        # the frontend builds the ids from the keys of /categories
+        res = self.client().post('/quizzes', json={
+            "quiz_category": {"id": "1", "type": "Science"},
+            "previous_questions": []
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['category'], 1)
+
+        res = self.client().post('/quizzes', json={
+            "quiz_category": {"id": "science"},
+            "previous_questions": []
+        })
+        self.assertEqual(res.status_code, 400)
+
+    def test_quiz_plays_every_question_in_category_once(self):
+        total = json.loads(
+            self.client().get('/categories/1/questions').data
+            )['total_questions']
+        quiz = dict(self.new_quizzes, previous_questions=[])
+
+        while True:
+            data = json.loads(self.client().post('/quizzes', json=quiz).data)
+            if 'question' not in data:
+                break
+            self.assertEqual(data['question']['category'], 1)
+            quiz['previous_questions'] = data['previous_questions']
+
+        served = quiz['previous_questions']
+        self.assertEqual(len(served), total)
+        self.assertEqual(len(set(served)), total)
+
+    # /quizzes/sessions
+    def test_quiz_index_files_questions_without_category_once(self):
+        ids = QuizIndex().load_rows([(1, None, 2), (2, 3, 2)])
+
+        self.assertEqual(list(ids[None]), [1, 2])
+        self.assertEqual(list(ids[(None, 2)]), [1, 2])
+        self.assertEqual(list(ids[3]), [2])
+
+    def test_quiz_index_reloaded_after_its_ttl(self):
+        app = create_app({'QUIZ_INDEX_TTL': 0})
+        with app.app_context():
+            quiz_index.load()
+            existing = [row[0] for row in db.session.query(Question.id)
+                        .filter(Question.category == 4)]
+            # written by another worker, none of the change hooks run here
+            created = db.get_engine(app).execute(
+                Question.__table__.insert().values(
+                    question='Other worker quiz question', answer='Answer',
+                    category=4, difficulty=2)).inserted_primary_key[0]
+
+            self.assertEqual(quiz_index.choose(4, existing), created)
+            db.get_engine(app).execute(Question.__table__.delete().where(
+                Question.id == created))
+            quiz_index.invalidate()
+
+    def test_question_stats_reloaded_after_their_ttl(self):
+        app = create_app({'QUESTION_STATS_TTL': 0})
+        with app.app_context():
+            total = question_stats.count(4)
+            # written by another worker, none of the change hooks run here
+            created = db.get_engine(app).execute(
+                Question.__table__.insert().values(
+                    question='Other worker counted question',
+                    answer='Answer', category=4, difficulty=2)
+                ).inserted_primary_key[0]
+
+            self.assertEqual(question_stats.count(4), total + 1)
+            db.get_engine(app).execute(Question.__table__.delete().where(
+                Question.id == created))
+            question_stats.invalidate()
+
+    def test_quiz_session_plays_every_question_once(self):
+        res = self.client().post('/quizzes/sessions', json=self.new_quizzes)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['session_id'])
+
+        next_url = '/quizzes/sessions/{}/next'.format(data['session_id'])
+        served = []
+        while True:
+            question = json.loads(self.client().post(next_url).data)
+            if 'question' not in question:
+                break
+            self.assertEqual(question['question']['category'], 1)
+            served.append(question['question']['id'])
+
+        self.assertEqual(len(served), data['total_questions'])
+        self.assertEqual(len(set(served)), data['total_questions'])
+
+    def test_quiz_session_category_id_sent_as_a_string(self):
+        res = self.client().post('/quizzes/sessions', json={
+            "quiz_category": {"id": "1", "type": "Science"}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        question = json.loads(self.client().post(
+            '/quizzes/sessions/{}/next'.format(data['session_id'])).data)
+        self.assertEqual(question['question']['category'], 1)
+
+        res = self.client().post('/quizzes/sessions', json={
+            "quiz_category": {"id": "science"}
+        })
+        self.assertEqual(res.status_code, 400)
+
+    def test_end_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json=self.random_quizzes)
+        session_id = json.loads(res.data)['session_id']
+
+        res = self.client().delete('/quizzes/sessions/{}'.format(session_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], session_id)
+
+        res = self.client().post(
+            '/quizzes/sessions/{}/next'.format(session_id))
+        self.assertEqual(res.status_code, 404)
+
+    def test_404_unknown_quiz_session(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_generate_quiz_reproducible_from_seed(self):
+        quiz = {"size": 8, "seed": 42}
+        res = self.client().post('/quizzes/generate', json=quiz)
+        data = json.loads(res.data)
+        again = json.loads(self.client().post(
+            '/quizzes/generate', json=quiz).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['seed'], 42)
+        self.assertEqual(data['total_questions'], 8)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(len(set(ids)), 8)
+        self.assertEqual(ids, [question['id']
+                               for question in again['questions']])
+
+    def test_generate_quiz_difficulty_distribution(self):
+        stats = json.loads(self.client().get('/stats').data)
+        difficulties = [int(difficulty) for difficulty, count
+                        in stats['difficulties'].items() if count >= 3][:2]
+        quiz = {"size": 6, "difficulties": difficulties}
+        res = self.client().post('/quizzes/generate', json=quiz)
+        questions = json.loads(res.data)['questions']
+
+        self.assertEqual(res.status_code, 200)
+        for difficulty in difficulties:
+            self.assertEqual(len([question for question in questions
+                                  if question['difficulty'] == difficulty]),
+                             3)
+
+    def test_generate_quiz_category_weights(self):
+        quiz = {"size": 4, "categories": {"1": 1, "4": 1}}
+        res = self.client().post('/quizzes/generate', json=quiz)
+        questions = json.loads(res.data)['questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(question['category']
+                                for question in questions), [1, 1, 4, 4])
+
+    def test_generate_quiz_errors(self):
+        res = self.client().post('/quizzes/generate', json={"size": 0})
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post('/quizzes/generate',
+                                 json={"categories": [1000]})
+        self.assertEqual(res.status_code, 404)
+
+        available = json.loads(self.client().get(
+            '/stats?category=1&difficulty=1').data)['total_questions']
+        res = self.client().post('/quizzes/generate', json={
+            "size": available + 1,
+            "categories": [1],
+            "difficulties": [1]
+        })
+        self.assertEqual(res.status_code, 422)
+
     def test_404_no_id_quizzes(self):
         res = self.client().post('/quizzes', json=self.no_id_quizzes)
         data = json.loads(res.data)
@@ -291,6 +962,601 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'method not allowed')
 
+    # /stats
+    def test_stats_totals(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        total = json.loads(self.client().get('/questions').data)[
+            'total_questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(sum(data['categories'].values()), total)
+        self.assertEqual(sum(data['difficulties'].values()), total)
+        self.assertEqual(data['categories']['1'], sum(
+            data['categories_by_difficulty']['1'].values()))
+
+    def test_stats_follow_writes(self):
+        url = '/stats?category=1&difficulty=5'
+        before = json.loads(self.client().get(url).data)['total_questions']
+
+        question = dict(self.new_question, question='Hardest science one',
+                        category=1, difficulty=5)
+        created = json.loads(self.client().post(
+            '/questions', json=question).data)['created']
+        after_insert = json.loads(self.client().get(url).data)
+        self.client().delete('/questions/{}'.format(created))
+        after_delete = json.loads(self.client().get(url).data)
+
+        self.assertEqual(after_insert['total_questions'], before + 1)
+        self.assertEqual(after_insert['current_category'], 1)
+        self.assertEqual(after_insert['current_difficulty'], 5)
+        self.assertEqual(after_delete['total_questions'], before)
+
+    # /healthz and /readyz
+    def test_healthz(self):
+        res = self.client().get('/healthz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+    def test_readyz_reports_startup_phases(self):
+        res = self.client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['ready'], True)
+        self.assertEqual(data['database'], True)
+        self.assertEqual(set(data['phases']), {name for name, _ in PHASES})
+
+    def test_readyz_503_until_warmed_up(self):
+        self.client().get('/healthz')
+        startup.ready = False
+        self.addCleanup(startup.warm_up, self.app)
+
+        res = self.client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['ready'], False)
+
+    def test_warm_up_on_first_request_when_disabled(self):
+        app = create_app({'WARM_UP': False})
+        self.assertIsNot(startup.app, app)
+
+        res = app.test_client().get('/readyz')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIs(startup.app, app)
+
+    def test_no_warm_up_in_cli_commands(self):
+        with click.Context(click.Command('upgrade')):
+            app = create_app()
+
+        self.assertIsNot(startup.app, app)
+
+    def test_after_fork_disposes_the_replica_engines(self):
+        self.app.config['SQLALCHEMY_REPLICA_URIS'] = [
+            self.app.config['SQLALCHEMY_DATABASE_URI']]
+        self.app.extensions.pop('replicas', None)
+        self.addCleanup(self.app.extensions.pop, 'replicas', None)
+        self.addCleanup(self.app.config.pop, 'SQLALCHEMY_REPLICA_URIS')
+        engine = replicas.replica_set(self.app).engines[0]
+        engine.connect().close()
+        pool = engine.pool
+
+        startup.after_fork()
+
+        self.assertIsNot(engine.pool, pool)
+
+    # /pool
+    def test_pool_status(self):
+        res = self.client().get('/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['pool']['class'])
+
+    def test_metered_pool_records_checkouts_and_timeouts(self):
+        engine = create_engine('sqlite://', poolclass=MeteredQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.01)
+        connection = engine.connect()
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        connection.close()
+        engine.connect().close()
+
+        self.assertEqual(engine.pool.checkouts, 3)
+        self.assertEqual(engine.pool.timeouts, 1)
+        self.assertTrue(engine.pool.wait_seconds_max >= 0.01)
+
+    # per-request instrumentation, served by the Flask app
+    def instrumented_client(self, **config):
+        config['INSTRUMENTATION'] = True
+        instrumentation.reset()
+        return create_app(config).test_client()
+
+    def test_instrumentation_off_by_default(self):
+        res = self.app.test_client().get('/categories')
+
+        self.assertNotIn('Server-Timing', res.headers)
+        self.assertEqual(self.app.test_client().get('/metrics').status_code,
+                         404)
+
+    def test_instrumentation_server_timing_and_log_line(self):
+        client = self.instrumented_client()
+        with self.assertLogs('flaskr.requests', 'INFO') as logs:
+            res = client.post('/questions', json=self.new_searchterm)
+
+        self.assertEqual(res.status_code, 200)
+        timing = res.headers['Server-Timing']
+        self.assertIn('app;dur=', timing)
+        self.assertIn('serialize;dur=', timing)
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['endpoint'], 'add_a_question')
+        self.assertEqual(line['status'], 200)
+        self.assertTrue(line['sql_statements'] >= 1)
+        self.assertTrue(line['rows'] >= 1)
+        self.assertIn('"{} statements, {} rows"'.format(
+            line['sql_statements'], line['rows']), timing)
+
+    def test_instrumentation_metrics_endpoint(self):
+        client = self.instrumented_client()
+        client.get('/categories')
+        client.get('/questions?page=1000')
+        res = client.get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn('trivia_requests_total{endpoint="get_categories",'
+                      'method="GET",status="200"} 1', body)
+        self.assertIn('trivia_requests_total{endpoint='
+                      '"retrieve_all_questions",method="GET",status="404"} 1',
+                      body)
+        self.assertIn('trivia_request_duration_seconds_count'
+                      '{endpoint="get_categories"} 1', body)
+        self.assertIn('trivia_sql_statements_total'
+                      '{endpoint="get_categories"}', body)
+
+    def test_instrumentation_profiles_requests_with_token(self):
+        client = self.instrumented_client(PROFILE_TOKEN='secret',
+                                          PROFILE_DIR=tempfile.mkdtemp())
+        res = client.get('/questions?page=1', headers={'X-Profile': 'wrong'})
+        self.assertNotIn('X-Profile-Dump', res.headers)
+
+        res = client.get('/questions?page=1', headers={'X-Profile': 'secret'})
+        path = res.headers['X-Profile-Dump']
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+    # compact question store
+    def store_app(self):
+        app = create_app({'QUESTION_STORE': True})
+        self.addCleanup(question_store.configure, {})
+        return app
+
+    def test_question_store_pages_match_the_database(self):
+        app = self.store_app()
+        with app.app_context():
+            everything = read_questions().order_by(Question.id)
+            self.assertEqual(question_store.page(None, 2),
+                             everything.offset(10).limit(10).all())
+            self.assertEqual(question_store.page(None, after_id=5),
+                             everything.filter(Question.id > 5)
+                             .limit(10).all())
+            self.assertEqual(question_store.page(4), everything.filter(
+                Question.category == 4).limit(10).all())
+            self.assertEqual(question_store.page(None, 0), [])
+            self.assertEqual(question_store.page(None, 1000), [])
+
+        res = app.test_client().get('/questions?after_id=0')
+        question_store.configure({})
+        expected = app.test_client().get('/questions?after_id=0')
+        self.assertEqual(res.data, expected.data)
+
+    def test_question_store_follows_writes(self):
+        app = self.store_app()
+        client = app.test_client()
+        question = dict(self.new_question, question='Store question')
+        with app.app_context():
+            question_store.load()
+
+        created = json.loads(client.post('/questions', json=question)
+                             .data)['created']
+        record = question_store.get(created)
+        self.assertEqual(record.question, 'Store question')
+        self.assertEqual(record.answer, question['answer'])
+        self.assertEqual(question_store.page(2, after_id=created - 1),
+                         [record])
+
+        client.delete('/questions/{}'.format(created))
+        self.assertIsNone(question_store.get(created))
+        self.assertEqual(question_store.page(2, after_id=created - 1), [])
+
+    def test_question_store_keeps_large_difficulties(self):
+        app = self.store_app()
+        client = app.test_client()
+        question = dict(self.new_question, question='Hard question',
+                        difficulty=200)
+        with app.app_context():
+            question_store.load()
+
+        res = client.post('/questions', json=question)
+        created = json.loads(res.data)['created']
+        self.assertEqual(question_store.get(created).difficulty, 200)
+        self.assertEqual(client.get('/questions').status_code, 200)
+        client.delete('/questions/{}'.format(created))
+
+    def test_question_store_deletes_a_question_of_category_0(self):
+        app = self.store_app()
+        with app.app_context():
+            question_store.load()
+        question = Question('Uncategorized', 'Answer', 0, 1)
+        question.id = 1000000
+
+        question_store.on_question_change('insert', question)
+        question_store.on_question_change('delete', question)
+
+        self.assertTrue(question_store.stats()['loaded'])
+        self.assertIsNone(question_store.get(question.id))
+
+    def test_question_store_serves_quizzes(self):
+        app = self.store_app()
+        res = app.test_client().post('/quizzes', json=self.new_quizzes)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'],
+                         question_store.get(data['question']['id']).format())
+
+    def test_question_store_memory_stats(self):
+        app = self.store_app()
+        with app.app_context():
+            question_store.load()
+        res = app.test_client().get('/cache')
+        stats = json.loads(res.data)['question_store']
+
+        self.assertEqual(stats['loaded'], True)
+        self.assertTrue(stats['questions'] > 0)
+        self.assertTrue(stats['strings'] <= 2 * stats['questions'])
+        self.assertTrue(stats['bytes_per_100k_questions'] > 0)
+
+    # shared question snapshot
+    def snapshot_app(self):
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snap')
+        app = create_app({'QUESTION_SNAPSHOT': path,
+                          'SNAPSHOT_CHECK_INTERVAL': 0})
+        result = app.test_cli_runner().invoke(args=['snapshot', 'build'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return app
+
+    def test_snapshot_matches_the_database(self):
+        app = self.snapshot_app()
+        snapshot = question_snapshot.current()
+        self.assertIsInstance(snapshot.ids, memoryview)
+
+        with app.app_context():
+            everything = read_questions().order_by(Question.id)
+            self.assertEqual(snapshot.page(None, 2),
+                             everything.offset(10).limit(10).all())
+            self.assertEqual(snapshot.page(4, after_id=5), everything.filter(
+                Question.category == 4, Question.id > 5).limit(10).all())
+            self.assertEqual(snapshot.page(None, 1000), [])
+            self.assertEqual(snapshot.page(1000), [])
+            question = everything.first()
+            self.assertEqual(snapshot.get(question.id), question)
+            self.assertEqual(dict(snapshot.categories()), {
+                category.id: category.type for category in Category.query})
+
+        res = app.test_client().get('/categories/4/questions?after_id=5')
+        self.assertEqual(res.status_code, 200)
+
+    def test_snapshot_remapped_after_a_new_generation(self):
+        app = self.snapshot_app()
+        client = app.test_client()
+        self.assertEqual(question_snapshot.current().generation, 1)
+
+        res = client.post('/questions', json=dict(
+            self.new_question, question='Snapshot question'))
+        created = json.loads(res.data)['created']
+        # this worker wrote, it reads the database until a new generation
+        self.assertIsNone(question_snapshot.current())
+
+        question_snapshot.rebuild()
+        snapshot = question_snapshot.current()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(snapshot.get(created).question, 'Snapshot question')
+
+        client.delete('/questions/{}'.format(created))
+        self.assertIsNone(question_snapshot.current())
+
+    def test_snapshot_remap_reloads_the_caches(self):
+        app = self.snapshot_app()
+        client = app.test_client()
+        before = json.loads(client.get('/categories/4/questions').data)
+        self.assertEqual(question_snapshot.current().generation, 1)
+
+        # written by another worker, none of the change hooks run here
+        with app.app_context():
+            created = db.get_engine(app).execute(
+                Question.__table__.insert().values(
+                    question='Other worker question', answer='Answer',
+                    category=4, difficulty=200)).inserted_primary_key[0]
+        result = app.test_cli_runner().invoke(args=['snapshot', 'build'])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        snapshot = question_snapshot.current()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertEqual(snapshot.get(created).difficulty, 200)
+        self.assertIn(created, quiz_index.current()[4])
+        after = json.loads(client.get('/categories/4/questions').data)
+        self.assertEqual(after['total_questions'],
+                         before['total_questions'] + 1)
+
+        client.delete('/questions/{}'.format(created))
+
+    def test_snapshot_remap_after_a_new_file_of_the_same_generation(self):
+        app = self.snapshot_app()
+        client = app.test_client()
+        self.assertEqual(question_snapshot.current().generation, 1)
+
+        with app.app_context():
+            created = db.get_engine(app).execute(
+                Question.__table__.insert().values(
+                    question='Rebuilt snapshot question', answer='Answer',
+                    category=4, difficulty=2)).inserted_primary_key[0]
+        os.remove(question_snapshot.path)
+        result = app.test_cli_runner().invoke(args=['snapshot', 'build'])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        snapshot = question_snapshot.current()
+        self.assertEqual(snapshot.generation, 1)
+        self.assertEqual(snapshot.get(created).question,
+                         'Rebuilt snapshot question')
+        self.assertIn(created, quiz_index.current()[4])
+
+        client.delete('/questions/{}'.format(created))
+
+    def test_snapshot_build_needs_a_path(self):
+        result = self.app.test_cli_runner().invoke(
+            args=['snapshot', 'build'])
+
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('QUESTION_SNAPSHOT', result.output)
+
+    # read replicas, a copy of the test database whose first answer differs
+    def replica_app(self, *other_urls):
+        url = self.app.config['SQLALCHEMY_DATABASE_URI']
+        if not url.startswith('sqlite:///'):
+            self.skipTest('replica copies are made of SQLite databases')
+
+        path = os.path.join(tempfile.mkdtemp(), 'replica.db')
+        primary = sqlite3.connect(url[len('sqlite:///'):])
+        replica = sqlite3.connect(path)
+        primary.backup(replica)
+        primary.close()
+        self.question_id = replica.execute(
+            'SELECT min(id) FROM questions').fetchone()[0]
+        replica.execute("UPDATE questions SET answer = 'From the replica' "
+                        "WHERE id = ?", (self.question_id,))
+        replica.commit()
+        replica.close()
+
+        replicas.last_write = None
+        return create_app({'SQLALCHEMY_REPLICA_URIS':
+                           ['sqlite:///' + path] + list(other_urls)})
+
+    def answer_read(self, app):
+        with app.app_context():
+            return read_questions().filter(
+                Question.id == self.question_id).one().answer
+
+    def test_replica_reads_only_inside_reading(self):
+        app = self.replica_app()
+
+        self.assertNotEqual(self.answer_read(app), 'From the replica')
+        with replicas.reading():
+            self.assertEqual(self.answer_read(app), 'From the replica')
+
+    def test_replica_reads_of_get_requests_until_a_write(self):
+        app = self.replica_app()
+        client = app.test_client()
+
+        res = client.get('/questions/export')
+        self.assertIn(b'From the replica', res.data)
+
+        res = client.post('/questions', json=dict(
+            self.new_question, question='Replica routing question'))
+        created = json.loads(res.data)['created']
+        self.assertIn('trivia_primary=1', res.headers['Set-Cookie'])
+
+        # the client's cookie and this worker's last write both keep the
+        # reads on the primary
+        res = client.get('/questions/export')
+        self.assertNotIn(b'From the replica', res.data)
+        replicas.last_write = None
+        res = client.get('/questions/export')
+        self.assertNotIn(b'From the replica', res.data)
+        client.delete('/questions/{}'.format(created))
+
+    def test_replica_round_robin_skips_unhealthy_replicas(self):
+        missing = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'missing', 'replica.db')
+        app = self.replica_app(missing)
+
+        with replicas.reading():
+            for _ in range(3):
+                self.assertEqual(self.answer_read(app), 'From the replica')
+        status = replicas.replica_set(app).status()
+        self.assertEqual([replica['healthy'] for replica in status],
+                         [True, False])
+
+        app = self.replica_app('sqlite://')
+        replica_set = replicas.replica_set(app)
+        self.assertEqual([replica_set.choose() for _ in range(4)],
+                         replica_set.engines * 2)
+
+    # SQL statement and row budgets per endpoint
+    def count_queries(self):
+        with self.app.app_context():
+            return QueryCounter(self.db.get_engine(self.app))
+
+    def test_query_budget_categories(self):
+        with self.count_queries() as counter:
+            res = self.client().get('/categories')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 1)
+        self.assertEqual(counter.questions_loaded, 0)
+
+    def test_query_budget_paginated_questions(self):
+        with self.count_queries() as counter:
+            res = self.client().get('/questions?page=1')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 3)
+        self.assertEqual(counter.questions_loaded, 0)
+
+    def test_query_budget_questions_within_a_category(self):
+        with self.count_queries() as counter:
+            res = self.client().get('/categories/1/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 3)
+        self.assertEqual(counter.questions_loaded, 0)
+
+    def test_query_budget_search(self):
+        with self.count_queries() as counter:
+            res = self.client().post('/questions', json=self.new_searchterm)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 2)
+        self.assertEqual(counter.questions_loaded, 0)
+
+    def test_query_budget_suggest(self):
+        self.client().get('/questions/suggest?q=wh')
+        with self.count_queries() as counter:
+            res = self.client().get('/questions/suggest?q=wh')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(counter.statements, 0)
+
+    def test_query_budget_stats(self):
+        self.client().get('/stats')
+        with self.count_queries() as counter:
+            res = self.client().get('/stats?category=1&difficulty=2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(counter.statements, 0)
+
+    def test_query_budget_questions_by_ids(self):
+        ids = [question['id'] for question in json.loads(
+            self.client().get('/questions').data)['questions']]
+        with self.count_queries() as counter:
+            res = self.client().post('/questions/batch',
+                                     json={"ids": ids + [99999]})
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 1)
+
+        # cached questions are not fetched again
+        with self.count_queries() as counter:
+            self.client().post('/questions/batch', json={"ids": ids[::-1]})
+        self.assertEqual(counter.statements, 0)
+
+    def test_query_budget_quizzes(self):
+        self.client().post('/quizzes', json=self.random_quizzes)
+        with self.count_queries() as counter:
+            res = self.client().post('/quizzes', json=self.random_quizzes)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 1)
+        self.assertEqual(counter.questions_loaded, 0)
+
+    def test_query_budget_create_and_delete_question(self):
+        question = dict(self.new_question, question='Query budget question')
+        with self.count_queries() as counter:
+            res = self.client().post('/questions', json=question)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertLessEqual(counter.statements, 6)
+        self.assertLessEqual(counter.questions_loaded, 11)
+
+        created = json.loads(res.data)['created']
+        with self.count_queries() as counter:
+            res = self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.statements, 6)
+        self.assertLessEqual(counter.questions_loaded, 11)
+
+    # query plans use an index
+    def assert_uses_indexes(self, counter):
+        scans = full_scans_of_questions(counter.engine, counter.executed)
+        self.assertEqual(scans, [])
+
+    def test_plans_use_indexes_for_category_questions(self):
+        with self.count_queries() as counter:
+            res = self.client().get('/categories/1/questions?page=2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assert_uses_indexes(counter)
+
+    def test_plans_use_indexes_for_keyset_pages(self):
+        with self.count_queries() as counter:
+            res = self.client().get('/questions?after_id=1')
+
+        self.assertEqual(res.status_code, 200)
+        self.assert_uses_indexes(counter)
+
+    def test_plans_use_indexes_for_quizzes(self):
+        with self.count_queries() as counter:
+            res = self.client().post('/quizzes', json=self.new_quizzes)
+
+        self.assertEqual(res.status_code, 200)
+        self.assert_uses_indexes(counter)
+
+    def test_plans_use_indexes_for_create_and_delete(self):
+        question = dict(self.new_question, question='Query plan question')
+        with self.count_queries() as counter:
+            res = self.client().post('/questions', json=question)
+            created = json.loads(res.data)['created']
+            res = self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 200)
+        self.assert_uses_indexes(counter)
+
+    def test_422_duplicate_question(self):
+        question = dict(self.new_question, question='Duplicate question')
+        res = self.client().post('/questions', json=question)
+        created = json.loads(res.data)['created']
+
+        res = self.client().post('/questions', json=question)
+        data = json.loads(res.data)
+        self.client().delete('/questions/{}'.format(created))
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    def test_asgi_sqlite_path_relative_to_the_app(self):
+        if TEST_MODE != 'asgi':
+            self.skipTest('the async driver is only used by the ASGI mode')
+        root = tempfile.mkdtemp()
+        database = AsyncDatabase('sqlite:///relative.db', root_path=root)
+
+        async def touch():
+            await database.connect()
+            await database.close()
+        asyncio.get_event_loop().run_until_complete(touch())
+
+        self.assertTrue(os.path.exists(os.path.join(root, 'relative.db')))
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file